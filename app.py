@@ -1,19 +1,38 @@
 from flask import Flask, jsonify, render_template_string, session, redirect, request, Response
-import serial
-import time
+import atexit
 import socket
 import threading
-import re
 import os
 import csv
 import io
 import json
-from collections import deque
+import math
+import time
+import zlib
 from datetime import datetime
+from functools import partial
 from fpdf import FPDF
+import archivo
+from bitacora import BitacoraTramas
+from difusion import DifusorEstado
+from eventos import AlmacenEventos
+from historial import SENSORES_HISTORIAL
+from respaldo import RespaldoEstado
+from retencion import AlmacenResumenes, MantenimientoAlmacenamiento
+from ingesta import MotorIngesta
+from lineas import EVENTOS_RECIENTES, LineaLlenado, detectar_puertos, puertos_disponibles
+from tramas import BACKEND_JSON
+
+# WebSocket opcional (flask-sock): sin él el panel usa /stream y /led
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+except ImportError:
+    Sock = None
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey123'
+sock = Sock(app) if Sock is not None else None
 
 # ============= CREDENCIALES DE USUARIO =============
 USUARIOS = {
@@ -22,213 +41,160 @@ USUARIOS = {
 }
 
 # ============= CONFIGURACIÓN ARDUINO =============
-SERIAL_PORT = 'COM4'
-BAUD_RATE = 9600
+# Una entrada por línea de llenado: id de la línea -> puerto serial de su Arduino.
+# La primera es la línea por defecto de la API y del panel.
+LINEAS_LLENADO = {
+    "linea1": 'COM4',
+}
+
+# 'asyncio': un bucle atiende todos los puertos con add_reader() (solo POSIX)
+# 'hilos': por línea, hilo lector + hilo de procesamiento unidos por una cola
+MODO_INGESTA = 'asyncio' if os.name == 'posix' else 'hilos'
+
+# Cola entre el hilo lector y el de procesamiento (ver ingesta.POLITICAS)
+CAPACIDAD_COLA = 4096
+POLITICA_COLA = 'descartar_antiguas'
+
+# Historial en memoria de ULTRA y TEMP: HISTORIAL_HORAS a HISTORIAL_HZ muestras
+# por segundo. Cada muestra ocupa 16 bytes por sensor: 24 h a 10 Hz son
+# 864000 muestras, unos 27.6 MB por línea entre los dos sensores. Además cada
+# línea guarda resúmenes de 1 s / 1 min / 1 h (historial.NIVELES_RESUMEN), ~13 MB.
+HISTORIAL_HORAS = 24
+HISTORIAL_HZ = 10
+HISTORIAL_PUNTOS = 2000  # máximo de puntos por respuesta de /historial
+
+# /reporte-llenados?before=<id>&limit=: páginas hacia atrás en el historial de eventos
+EVENTOS_POR_PAGINA = 100
+LIMITE_EVENTOS = 1000
+
+# /estado-completo: lo que el panel necesita por consulta cuando no hay /ws ni /stream
+SECCIONES_PANEL = ('datos', 'conexion', 'reporte')
+
+# Eventos de llenado en SQLite (WAL); el panel usa la caché de los últimos 100
+ARCHIVO_EVENTOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eventos.db')
+
+# Bitácora de tramas crudas: un directorio por línea, segmentos de 64 MB / 1 h
+# comprimidos al cerrarse. Para extraer un rango: python bitacora.py tramas/linea1 --desde ...
+BITACORA_TRAMAS = True
+DIRECTORIO_TRAMAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tramas')
+
+# Respaldo del contador de vasos y de los detectores de flancos (respaldo.py)
+ARCHIVO_RESPALDO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'respaldo.json')
+
+# Archivo columnar diario (Parquet) de la bitácora y los eventos; requiere pyarrow.
+# También se puede usar a mano: python archivo.py compactar / exportar ...
+ARCHIVO_COLUMNAR = True
+DIRECTORIO_ARCHIVO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archivo')
+
+# Retención en días por clase de dato (None = para siempre). Antes de borrar la
+# bitácora cruda se resume en minutos en resumenes.db, que /historial usa para
+# rangos más viejos que la memoria. Límites de CPU/disco en retencion.py.
+RETENCION_DIAS = {'tramas': 7, 'resumenes': 365, 'eventos': None}
+ARCHIVO_RESUMENES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resumenes.db')
+
+# /stream (Server-Sent Events): el panel recibe los cambios en vez de consultar.
+# Sin mensajes durante STREAM_LATIDO_S se manda un comentario para mantener viva la conexión.
+STREAM_LATIDO_S = 15
+STREAM_REINTENTO_MS = 2000  # espera del navegador antes de reconectar
+
+# /ws (WebSocket, requiere flask-sock): la misma telemetría, pero de los sensores
+# solo los campos que cambiaron, y comandos de la banda con id y confirmación
+WS_REVISION_S = 0.5  # cada cuánto el envío revisa si el navegador cerró
 
 # ============= ESTADOS DEL SISTEMA =============
-led_state = "off"
-arduino = None
-connection_status = "Conectando..."
-puertos_disponibles = []
 flash_message = {"text": "", "type": ""}  # Para mensajes temporales
 
-sensor_data = {
-    "IR": "Esperando datos...",
-    "ULTRA": "Esperando datos...",
-    "TEMP": "Esperando datos...",
-    "BOMBA": "Esperando datos..."
-}
+# Se crean en iniciar(): importar app.py (pruebas, flask run) no crea archivos
+# ni arranca hilos. Las rutas los leen del módulo en cada pedido.
+ALMACEN = None
+RESPALDO = None
+RESUMENES = None
+DIFUSOR = None
+ARCHIVADO = None
+LINEAS = {}
+LINEA_PRINCIPAL = next(iter(LINEAS_LLENADO))
 
-# ============= CONTADORES Y REPORTES =============
-llenados_vasos = 0
-eventos_llenado = deque(maxlen=100)
+def iniciar():
+    # Almacenes, líneas, lectura de los puertos e hilos de fondo (escritor de
+    # eventos, respaldo, compactador, mantenimiento, difusor). Una sola vez.
+    global ALMACEN, RESPALDO, RESUMENES, DIFUSOR, ARCHIVADO
+    if ALMACEN is not None:
+        return
+    ALMACEN = AlmacenEventos(ARCHIVO_EVENTOS)
+    atexit.register(ALMACEN.detener)  # escribir los eventos pendientes al salir
+    RESPALDO = RespaldoEstado(ARCHIVO_RESPALDO)
 
-# ============= DETECCIÓN DE PUERTOS DISPONIBLES =============
-def detectar_puertos():
-    global puertos_disponibles
-    puertos_disponibles = []
-    
-    if os.name == 'nt':
-        for i in range(1, 20):
-            port_name = f'COM{i}'
-            try:
-                s = serial.Serial(port_name)
-                s.close()
-                puertos_disponibles.append(port_name)
-            except (OSError, serial.SerialException):
-                pass
-    else:
-        for port in ['/dev/ttyACM0', '/dev/ttyACM1', '/dev/ttyUSB0', '/dev/ttyUSB1']:
-            if os.path.exists(port):
-                puertos_disponibles.append(port)
-    
-    return puertos_disponibles
+    # Mismo diccionario que ya usan las rutas: se llena, no se reemplaza
+    LINEAS.update({
+        id_linea: LineaLlenado(id_linea, puerto, CAPACIDAD_COLA, POLITICA_COLA,
+                               puerto_alternativo=len(LINEAS_LLENADO) == 1,
+                               muestras_historial=HISTORIAL_HORAS * 3600 * HISTORIAL_HZ,
+                               intervalo_historial=1 / HISTORIAL_HZ,
+                               almacen=ALMACEN,
+                               respaldo=RESPALDO,
+                               bitacora=BitacoraTramas(os.path.join(DIRECTORIO_TRAMAS, id_linea))
+                               if BITACORA_TRAMAS else None)
+        for id_linea, puerto in LINEAS_LLENADO.items()
+    })
+    for linea in LINEAS.values():
+        RESPALDO.vigilar(linea)
+        if linea.bitacora is not None:
+            atexit.register(linea.bitacora.detener)
+    RESPALDO.iniciar()
+    atexit.register(RESPALDO.guardar)
+
+    directorios_bitacora = {id_linea: os.path.join(DIRECTORIO_TRAMAS, id_linea) for id_linea in LINEAS}
+    if ARCHIVO_COLUMNAR and archivo.disponible():
+        archivo.CompactadorDiario(DIRECTORIO_ARCHIVO, directorios_bitacora, ARCHIVO_EVENTOS).iniciar()
+        # La bitácora cruda no se borra antes de estar en el archivo diario
+        ARCHIVADO = partial(archivo.archivado, DIRECTORIO_ARCHIVO, 'telemetria')
+    RESUMENES = AlmacenResumenes(ARCHIVO_RESUMENES)
+    # Siempre: la retención de eventos y resúmenes no depende de la bitácora, y
+    # las líneas sin directorio de tramas se saltan
+    MantenimientoAlmacenamiento(RESUMENES, directorios_bitacora, ARCHIVO_EVENTOS, RETENCION_DIAS,
+                                archivado=ARCHIVADO).iniciar()
+    DIFUSOR = DifusorEstado(LINEAS)
+    DIFUSOR.iniciar()
 
-# ============= FUNCIONES DE CONEXIÓN =============
-def conectar_arduino():
-    global arduino, connection_status, SERIAL_PORT
-    
     detectar_puertos()
     print(f"🔍 Puertos disponibles: {puertos_disponibles}")
-    
-    while True:
-        try:
-            if arduino is None or not arduino.is_open:
-                print(f"🔌 Intentando conectar a {SERIAL_PORT}...")
-                arduino = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-                time.sleep(2)
-                arduino.flushInput()
-                connection_status = "Conectado"
-                print(f"[✅] Conexión establecida con Arduino en {SERIAL_PORT}")
-        except serial.SerialException as e:
-            if "PermissionError" in str(e) or "Acceso denegado" in str(e):
-                connection_status = f"Error: Acceso denegado a {SERIAL_PORT}"
-                print(f"[❌] Acceso denegado al puerto {SERIAL_PORT}. ¿Está abierto en otro programa?")
-                
-                if puertos_disponibles:
-                    nuevo_puerto = next((p for p in puertos_disponibles if p != SERIAL_PORT), None)
-                    if nuevo_puerto:
-                        print(f"🔄 Intentando con puerto alternativo: {nuevo_puerto}")
-                        SERIAL_PORT = nuevo_puerto
-            else:
-                connection_status = f"Error: {str(e)}"
-                print(f"[❌] Error de conexión: {str(e)}")
-            
-            if arduino and arduino.is_open:
-                try:
-                    arduino.close()
-                except:
-                    pass
-            arduino = None
-        except Exception as e:
-            connection_status = f"Error: {str(e)}"
-            print(f"[❌] Error inesperado: {str(e)}")
-            arduino = None
-        
-        time.sleep(3)
-
-# ============= LECTURA DE DATOS SERIAL (CORREGIDA PARA TEMPERATURA) =============
-def leer_serial():
-    global sensor_data, led_state, llenados_vasos
-    
-    bomba_anterior = "Apagada"
-    ir_anterior = "Sin vaso"
-    
-    while True:
-        if arduino and arduino.is_open:
-            try:
-                if arduino.in_waiting > 0:
-                    linea = arduino.readline().decode('utf-8', errors='ignore').strip()
-                    if linea:
-                        # Manejo de comandos simples
-                        if "BANDA:ON" in linea:
-                            led_state = "on"
-                        elif "BANDA:OFF" in linea:
-                            led_state = "off"
-                        
-                        # Intentar parsear como JSON
-                        try:
-                            if linea.startswith('{') and linea.endswith('}'):
-                                data = json.loads(linea)
-                                
-                                # Extraer valores del JSON
-                                ir_val = data.get("IR", 1)
-                                ultra_val = data.get("ULTRA", 0)
-                                temp_val = data.get("TEMP", 0)
-                                bomba_str = data.get("BOMBA", "OFF")
-                                
-                                # Actualizar estado IR
-                                nuevo_estado_ir = "Vaso detectado" if ir_val == 0 else "Sin vaso"
-                                if ir_anterior == "Sin vaso" and nuevo_estado_ir == "Vaso detectado":
-                                    eventos_llenado.append({
-                                        'tipo': "Vaso",
-                                        'estado': "Colocado",
-                                        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
-                                        'nivel': f"{ultra_val} cm",
-                                        'temp': f"{temp_val} °C"
-                                    })
-                                ir_anterior = nuevo_estado_ir
-                                sensor_data["IR"] = nuevo_estado_ir
-                                
-                                # Actualizar ULTRA
-                                sensor_data["ULTRA"] = f"{ultra_val} cm"
-                                
-                                # Actualizar TEMP - CORRECCIÓN IMPORTANTE
-                                # Convertir a float y formatear correctamente
-                                try:
-                                    temp_val = float(temp_val)
-                                    sensor_data["TEMP"] = f"{temp_val:.1f} °C"  # Un decimal
-                                except (ValueError, TypeError):
-                                    sensor_data["TEMP"] = "Error"
-                                
-                                # Actualizar BOMBA
-                                nuevo_estado_bomba = "Encendida" if bomba_str == "ON" else "Apagada"
-                                if bomba_anterior == "Encendida" and nuevo_estado_bomba == "Apagada":
-                                    llenados_vasos += 1
-                                    eventos_llenado.append({
-                                        'tipo': "Vaso",
-                                        'estado': "Llenado completado",
-                                        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
-                                        'nivel': f"{ultra_val} cm",
-                                        'temp': f"{temp_val} °C"
-                                    })
-                                bomba_anterior = nuevo_estado_bomba
-                                sensor_data["BOMBA"] = nuevo_estado_bomba
-                                
-                        except json.JSONDecodeError:
-                            # Si falla el JSON, intentar con el formato antiguo
-                            if re.match(r'IR:\d+,ULTRA:\d+\.?\d*,TEMP:\d+\.?\d*,BOMBA:[01]', linea):
-                                partes = linea.split(',')
-                                for parte in partes:
-                                    if ':' in parte:
-                                        key, val = parte.split(':')
-                                        key = key.strip()
-                                        
-                                        if key == "IR":
-                                            nuevo_estado = "Vaso detectado" if val == "0" else "Sin vaso"
-                                            if ir_anterior == "Sin vaso" and nuevo_estado == "Vaso detectado":
-                                                eventos_llenado.append({
-                                                    'tipo': "Vaso",
-                                                    'estado': "Colocado",
-                                                    'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
-                                                    'nivel': sensor_data["ULTRA"],
-                                                    'temp': sensor_data["TEMP"]
-                                                })
-                                            ir_anterior = nuevo_estado
-                                            sensor_data["IR"] = nuevo_estado
-                                        
-                                        elif key == "ULTRA":
-                                            sensor_data["ULTRA"] = f"{val} cm"
-                                        
-                                        elif key == "TEMP":
-                                            # Manejo correcto de temperatura
-                                            try:
-                                                temp_val = float(val)
-                                                sensor_data["TEMP"] = f"{temp_val:.1f} °C"
-                                            except (ValueError, TypeError):
-                                                sensor_data["TEMP"] = "Error"
-                                        
-                                        elif key == "BOMBA":
-                                            nuevo_estado = "Encendida" if val == "1" else "Apagada"
-                                            if bomba_anterior == "Encendida" and nuevo_estado == "Apagada":
-                                                llenados_vasos += 1
-                                                eventos_llenado.append({
-                                                    'tipo': "Vaso",
-                                                    'estado': "Llenado completado",
-                                                    'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
-                                                    'nivel': sensor_data["ULTRA"],
-                                                    'temp': sensor_data["TEMP"]
-                                                })
-                                            bomba_anterior = nuevo_estado
-                                            sensor_data["BOMBA"] = nuevo_estado
-                                
-            except Exception as e:
-                print(f"[ERROR] Lectura serial: {str(e)}")
-                try:
-                    arduino.flushInput()
-                except:
-                    pass
-        time.sleep(0.1)
+    if MODO_INGESTA == 'asyncio':
+        # Un solo hilo con el bucle asyncio para todas las líneas
+        motor = MotorIngesta([linea.dispositivo() for linea in LINEAS.values()])
+        threading.Thread(target=motor.ejecutar, daemon=True).start()
+    else:
+        for linea in LINEAS.values():
+            linea.iniciar_hilos()
+
+TODAS = "todas"
+
+def linea_solicitada():
+    # ?linea=<id> elige la línea; sin parámetro se usa la principal
+    return LINEAS.get(request.args.get('linea') or LINEA_PRINCIPAL)
+
+def ver_todas():
+    return request.args.get('linea') == TODAS
+
+def linea_desconocida():
+    return jsonify({"error": "Línea desconocida", "lineas": list(LINEAS)}), 404
+
+# Las versiones (estado.version, id del último evento) vuelven a 0 al reiniciar:
+# el arranque va en el ETag para que una versión vieja no coincida con una nueva
+ARRANQUE = format(int(time.time()), 'x')
+
+def respuesta_versionada(version, armar):
+    # ETag débil con la versión del estado: si el navegador ya la tiene, 304
+    # vacío sin armar ni serializar la respuesta. Débil porque la versión identifica
+    # el estado, no los bytes exactos de la respuesta
+    etag = f"{ARRANQUE}-{version}"
+    if request.if_none_match.contains_weak(etag):
+        respuesta = Response(status=304)
+    else:
+        respuesta = jsonify(armar())
+    respuesta.set_etag(etag, weak=True)
+    respuesta.headers["Cache-Control"] = "no-cache"
+    return respuesta
+
 # ============= INTERFAZ WEB =============
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -1022,121 +988,241 @@ HTML_TEMPLATE = """
     </footer>
 
     <script>
+        const CANAL_WS = {{ 'true' if canal_ws else 'false' }};
+        
+        // WebSocket abierto (o null): si está, los comandos van por ahí
+        let canal = null;
+        let ultimoPedido = 0;
+        
         // Función para controlar el estado de la banda
         function controlLED(state) {
+            if (canal !== null && state !== 'estado') {
+                // La confirmación llega como mensaje 'ack' con el mismo id
+                ultimoPedido += 1;
+                canal.send(JSON.stringify({id: ultimoPedido, cmd: 'banda', estado: state}));
+                return;
+            }
             fetch('/led/' + state)
             .then(res => res.json())
-            .then(data => {
-                const led = document.getElementById("led-visual");
-                const msg = document.getElementById("message");
-                
-                // Actualizar LED visual
-                led.classList.remove("on", "off");
+            .then(mostrarResultadoBanda);
+        }
+        
+        function mostrarBanda(state) {
+            const led = document.getElementById("led-visual");
+            
+            // Actualizar LED visual
+            led.classList.remove("on", "off");
+            
+            if (state === "on") {
+                led.classList.add("on");
+                led.querySelector('.led-status').textContent = "ENCENDIDA";
+            } else {
+                led.classList.add("off");
+                led.querySelector('.led-status').textContent = "APAGADA";
+            }
+        }
+        
+        function mostrarResultadoBanda(data) {
+            const msg = document.getElementById("message");
+            mostrarBanda(data.state);
+            
+            // Actualizar mensaje de estado
+            msg.textContent = data.message;
+            msg.className = "status-message ";
+            
+            if (data.message.includes("✅")) {
+                msg.classList.add("status-success");
+            } else if (data.message.includes("❌")) {
+                msg.classList.add("status-error");
+            }
+        }
+        
+        // Función para mostrar los datos de los sensores
+        // Llegan números; el texto de cada tarjeta se arma aquí
+        function mostrarSensores(data) {
+            if (data.ULTRA === null) {
+                return;  // Todavía no llegó ninguna trama
+            }
+            
+            document.getElementById('ir').textContent = data.IR === 0 ? "Vaso detectado" : "Sin vaso";
+            document.getElementById('ultra').textContent = `${data.ULTRA} cm`;
+            document.getElementById('temp').textContent = data.TEMP === null ? "Error" : `${data.TEMP.toFixed(1)} °C`;
+            document.getElementById('bomba').textContent = data.BOMBA ? "Encendida" : "Apagada";
+            
+            // Actualizar indicadores de estado
+            document.getElementById('ir-status').className = 'sensor-status ' + (data.IR === 0 ? 'active' : '');
+            document.getElementById('ultra-status').className = 'sensor-status ' + (data.ULTRA !== null && data.ULTRA < 10 ? 'active' : '');
+            document.getElementById('bomba-status').className = 'sensor-status ' + (data.BOMBA ? 'active' : '');
+        }
+        
+        // Función para mostrar el estado de conexión
+        function mostrarEstadoConexion(data) {
+            const statusDot = document.getElementById('arduino-status-dot');
+            const statusText = document.getElementById('arduino-status-text');
+            const connectionIndicator = document.getElementById('connection-indicator');
+            
+            statusText.textContent = data.status;
+            
+            if (data.status.includes('Conectado')) {
+                statusDot.className = 'status-dot status-ok';
+                connectionIndicator.className = 'status-indicator status-connected';
+            } else if (data.status.includes('Error')) {
+                statusDot.className = 'status-dot status-error';
+                connectionIndicator.className = 'status-indicator status-disconnected';
+            } else {
+                statusDot.className = 'status-dot status-warning';
+                connectionIndicator.className = 'status-indicator status-disconnected';
+            }
+        }
+        
+        // Función para mostrar el reporte de llenados
+        // completo: la lista reemplaza a la mostrada; si no, son eventos nuevos que se agregan arriba
+        function mostrarReporte(data, completo) {
+            document.getElementById('vasos-count').textContent = data.vasos;
+            
+            const eventLog = document.getElementById('event-log');
+            if (completo || eventLog.querySelector('.event-type') === null) {
+                eventLog.innerHTML = '';
+            }
+            
+            if (completo && data.eventos.length === 0) {
+                eventLog.innerHTML = '<div class="event-item"><div class="event-details">No hay eventos registrados</div></div>';
+                return;
+            }
+            
+            data.eventos.forEach(evento => {
+                const eventItem = document.createElement('div');
+                eventItem.className = 'event-item';
                 
-                if (data.state === "on") {
-                    led.classList.add("on");
-                    led.querySelector('.led-status').textContent = "ENCENDIDA";
-                } else {
-                    led.classList.add("off");
-                    led.querySelector('.led-status').textContent = "APAGADA";
-                }
+                const statusClass = evento.estado.includes("completado") ? "completed" : "placed";
                 
-                // Actualizar mensaje de estado
-                msg.textContent = data.message;
-                msg.className = "status-message ";
+                eventItem.innerHTML = `
+                    <div class="event-type vaso">${evento.tipo}</div>
+                    <div class="event-status ${statusClass}">${evento.estado}</div>
+                    <div class="event-details">
+                        ${evento.timestamp}<br>
+                        ${evento.nivel} | ${evento.temp}
+                    </div>
+                `;
                 
-                if (data.message.includes("✅")) {
-                    msg.classList.add("status-success");
-                } else if (data.message.includes("❌")) {
-                    msg.classList.add("status-error");
-                }
+                eventLog.prepend(eventItem);
             });
+            
+            // Como la caché del servidor: los últimos 100
+            while (eventLog.children.length > 100) {
+                eventLog.lastElementChild.remove();
+            }
         }
         
-        // Función para actualizar los datos de los sensores
-        function actualizarSensores() {
-            fetch('/datos')
+        // Una consulta por tic a /estado-completo con la versión que ya se tiene de
+        // cada sección: solo vuelven las que cambiaron. Del reporte, con ?since=,
+        // solo los eventos posteriores al cursor.
+        const versiones = {};
+        let cursorEventos = null;
+        function actualizarPanel() {
+            const parametros = new URLSearchParams(versiones);
+            if (cursorEventos !== null) {
+                parametros.set('since', cursorEventos);
+            }
+            fetch('/estado-completo?' + parametros, {cache: 'no-store'})
             .then(res => res.json())
             .then(data => {
-                document.getElementById('ir').textContent = data.IR;
-                document.getElementById('ultra').textContent = data.ULTRA;
-                document.getElementById('temp').textContent = data.TEMP;
-                document.getElementById('bomba').textContent = data.BOMBA;
-                
-                // Actualizar indicadores de estado
-                const irStatus = document.getElementById('ir-status');
-                irStatus.className = 'sensor-status ' + (data.IR.includes("detectado") ? 'active' : '');
-                
-                const ultraStatus = document.getElementById('ultra-status');
-                try {
-                    const ultraValue = parseFloat(data.ULTRA);
-                    ultraStatus.className = 'sensor-status ' + (ultraValue < 10 ? 'active' : '');
-                } catch {
-                    ultraStatus.className = 'sensor-status';
+                Object.assign(versiones, data.versiones);
+                if (data.datos) {
+                    mostrarSensores(data.datos);
+                }
+                if (data.conexion) {
+                    mostrarEstadoConexion(data.conexion);
+                }
+                if (data.reporte) {
+                    if (data.reporte.truncado) {
+                        // Hubo más eventos de los que guarda el servidor: lista completa en el próximo tic
+                        cursorEventos = null;
+                        delete versiones.reporte;
+                        return;
+                    }
+                    mostrarReporte(data.reporte, cursorEventos === null);
+                    cursorEventos = data.reporte.since;
                 }
-                
-                const bombaStatus = document.getElementById('bomba-status');
-                bombaStatus.className = 'sensor-status ' + (data.BOMBA.includes("Encendida") ? 'active' : '');
             });
         }
         
-        // Función para actualizar el estado de conexión
-        function actualizarEstadoConexion() {
-            fetch('/estado-conexion')
-            .then(res => res.json())
-            .then(data => {
-                const statusDot = document.getElementById('arduino-status-dot');
-                const statusText = document.getElementById('arduino-status-text');
-                const connectionIndicator = document.getElementById('connection-indicator');
-                
-                statusText.textContent = data.status;
-                
-                if (data.status.includes('Conectado')) {
-                    statusDot.className = 'status-dot status-ok';
-                    connectionIndicator.className = 'status-indicator status-connected';
-                } else if (data.status.includes('Error')) {
-                    statusDot.className = 'status-dot status-error';
-                    connectionIndicator.className = 'status-indicator status-disconnected';
-                } else {
-                    statusDot.className = 'status-dot status-warning';
-                    connectionIndicator.className = 'status-indicator status-disconnected';
-                }
+        // Consulta periódica: solo si el navegador no tiene EventSource o /stream falla
+        let consultando = false;
+        function iniciarConsultas() {
+            if (consultando) {
+                return;
+            }
+            consultando = true;
+            setInterval(actualizarPanel, 500);
+            actualizarPanel();
+        }
+        
+        // /stream envía sensores, conexión y eventos solo cuando cambian
+        function iniciarStream() {
+            if (!window.EventSource) {
+                iniciarConsultas();
+                return;
+            }
+            const stream = new EventSource('/stream');
+            let fallos = 0;
+            stream.onopen = () => { fallos = 0; };
+            stream.addEventListener('datos', e => mostrarSensores(JSON.parse(e.data)));
+            stream.addEventListener('conexion', e => mostrarEstadoConexion(JSON.parse(e.data)));
+            stream.addEventListener('banda', e => mostrarBanda(JSON.parse(e.data).state));
+            stream.addEventListener('reporte', e => {
+                const data = JSON.parse(e.data);
+                mostrarReporte(data, data.completo);
             });
+            stream.onerror = () => {
+                // EventSource reintenta solo; tras varios fallos seguidos se vuelve a consultar
+                fallos += 1;
+                if (fallos >= 3 || stream.readyState === EventSource.CLOSED) {
+                    stream.close();
+                    iniciarConsultas();
+                }
+            };
         }
         
-        // Función para actualizar el reporte de llenados
-        function actualizarReporte() {
-            fetch('/reporte-llenados')
-            .then(res => res.json())
-            .then(data => {
-                document.getElementById('vasos-count').textContent = data.vasos;
-                
-                const eventLog = document.getElementById('event-log');
-                eventLog.innerHTML = '';
-                
-                if (data.eventos.length === 0) {
-                    eventLog.innerHTML = '<div class="event-item"><div class="event-details">No hay eventos registrados</div></div>';
-                    return;
+        // /ws: telemetría y comandos por una sola conexión. Si no se puede abrir
+        // se sigue con /stream; si se corta después de abierta, se reintenta.
+        function iniciarCanal() {
+            if (!CANAL_WS || !window.WebSocket) {
+                iniciarStream();
+                return;
+            }
+            const protocolo = location.protocol === 'https:' ? 'wss://' : 'ws://';
+            const ws = new WebSocket(protocolo + location.host + '/ws');
+            const sensores = {};
+            let abierto = false;
+            ws.onopen = () => {
+                abierto = true;
+                canal = ws;
+            };
+            ws.onmessage = e => {
+                const m = JSON.parse(e.data);
+                if (m.tipo === 'datos') {
+                    // Solo llegan los campos que cambiaron
+                    sensores[m.linea] = Object.assign(sensores[m.linea] || {}, m.cambios);
+                    mostrarSensores(sensores[m.linea]);
+                } else if (m.tipo === 'conexion') {
+                    mostrarEstadoConexion(m.datos);
+                } else if (m.tipo === 'reporte') {
+                    mostrarReporte(m.datos, m.datos.completo);
+                } else if (m.tipo === 'banda') {
+                    mostrarBanda(m.datos.state);
+                } else if (m.tipo === 'ack') {
+                    mostrarResultadoBanda(m.datos);
                 }
-                
-                data.eventos.forEach(evento => {
-                    const eventItem = document.createElement('div');
-                    eventItem.className = 'event-item';
-                    
-                    const statusClass = evento.estado.includes("completado") ? "completed" : "placed";
-                    
-                    eventItem.innerHTML = `
-                        <div class="event-type vaso">${evento.tipo}</div>
-                        <div class="event-status ${statusClass}">${evento.estado}</div>
-                        <div class="event-details">
-                            ${evento.timestamp}<br>
-                            ${evento.nivel} | ${evento.temp}
-                        </div>
-                    `;
-                    
-                    eventLog.prepend(eventItem);
-                });
-            });
+            };
+            ws.onclose = () => {
+                canal = null;
+                if (abierto) {
+                    setTimeout(iniciarCanal, 2000);
+                } else {
+                    iniciarStream();
+                }
+            };
         }
 
         // Función para exportar los datos a CSV
@@ -1209,16 +1295,8 @@ HTML_TEMPLATE = """
             // Inicializar estado
             controlLED('estado');
             
-            // Actualizar sensores cada 500ms
-            setInterval(actualizarSensores, 500);
-            
-            // Actualizar estado de conexión cada 2 segundos
-            setInterval(actualizarEstadoConexion, 2000);
-            actualizarEstadoConexion();
-            
-            // Actualizar reporte cada 2 segundos
-            setInterval(actualizarReporte, 2000);
-            actualizarReporte();
+            // Sensores, conexión y reporte llegan por /ws, /stream o consultas, lo que haya
+            iniciarCanal();
             
             // Comprobar si hay mensaje flash
             const response = await fetch('/get-flash-message');
@@ -1548,81 +1626,437 @@ def get_flash_message():
 def index():
     if not session.get('autenticado'):
         return redirect('/login')
-    return render_template_string(HTML_TEMPLATE, usuario=session.get('usuario', ''))
+    return render_template_string(HTML_TEMPLATE, usuario=session.get('usuario', ''), canal_ws=sock is not None)
 
 @app.route("/led/<state>")
 def led_control(state):
     if not session.get('autenticado'):
         return jsonify({"error": "No autenticado"}), 401
     
-    global led_state
-    message = ""
+    linea = linea_solicitada()
+    if linea is None:
+        return linea_desconocida()
 
     if state == "estado":
-        return jsonify({"state": led_state, "message": "Estado actual consultado."})
-
-    if arduino and arduino.is_open:
-        try:
-            command = '1\n' if state.lower() == "on" else '0\n'
-            
-            for _ in range(3):
-                arduino.write(command.encode())
-                time.sleep(0.1)
-            
-            led_state = state
-            message = f"✅ Banda {state.upper()} - Comando ejecutado"
-        except Exception as e:
-            message = f"❌ Error: {str(e)}"
-    else:
-        message = "❌ Arduino no disponible"
+        return jsonify({"state": linea.led_state, "message": "Estado actual consultado."})
 
+    message = linea.enviar_comando(state)
     return jsonify({"state": state, "message": message})
 
 @app.route("/datos")
 def datos():
     if not session.get('autenticado'):
         return jsonify({"error": "No autenticado"}), 401
-    return jsonify(sensor_data)
+    if not ver_todas() and linea_solicitada() is None:
+        return linea_desconocida()
+    # Números por defecto; ?formato=texto devuelve los textos de pantalla ("12.3 cm")
+    return respuesta_versionada(*seccion_datos(request.args.get('formato') == 'texto'))
 
 @app.route("/estado-conexion")
 def estado_conexion():
     if not session.get('autenticado'):
         return jsonify({"error": "No autenticado"}), 401
-    global connection_status
-    return jsonify({"status": connection_status, "puerto": SERIAL_PORT, "disponibles": puertos_disponibles})
+    if not ver_todas() and linea_solicitada() is None:
+        return linea_desconocida()
+    return respuesta_versionada(*seccion_conexion())
+
+@app.route("/estadisticas")
+def estadisticas():
+    # Contadores de tramas, cola y almacén: cambian con cada trama, por eso van
+    # aparte y sin ETag, para que /datos y /estado-conexion puedan responder 304
+    if not session.get('autenticado'):
+        return jsonify({"error": "No autenticado"}), 401
+    if ver_todas():
+        return jsonify({id_linea: linea.estadisticas() for id_linea, linea in LINEAS.items()})
+    linea = linea_solicitada()
+    if linea is None:
+        return linea_desconocida()
+    return jsonify(linea.estadisticas())
+
+# Cada sección del panel: (versión, función que arma el contenido) para la
+# línea pedida o todas. Las usan sus rutas (ETag) y /estado-completo
+def seccion_datos(texto=False):
+    # Versión: cambios de valores, no tramas (una línea quieta responde 304)
+    if ver_todas():
+        version = '.'.join(str(linea.estado.valores) for linea in LINEAS.values())
+        return version, lambda: {id_linea: linea.datos_sensores(texto) for id_linea, linea in LINEAS.items()}
+    linea = linea_solicitada()
+    return linea.estado.valores, lambda: linea.datos_sensores(texto)
+
+def seccion_conexion():
+    # El estado cambia desde el hilo de conexión, sin contador propio:
+    # la versión es un checksum de lo que se devolvería
+    if ver_todas():
+        estados = {id_linea: linea.estado_conexion() for id_linea, linea in LINEAS.items()}
+    else:
+        estados = linea_solicitada().estado_conexion()
+    return format(zlib.crc32(repr(estados).encode()), 'x'), lambda: estados
+
+def conteo_vasos(estados):
+    respuesta = {"vasos": sum(estado.vasos for estado in estados.values())}
+    if ver_todas():
+        respuesta["lineas"] = {id_linea: estado.vasos for id_linea, estado in estados.items()}
+    return respuesta
+
+def seccion_reporte(estados, since=None):
+    # Versión: vasos y último evento de cada línea (solo cambian en los flancos).
+    # Siempre de la caché de recientes; los rangos ?desde=/?hasta= no tienen versión
+    version = '.'.join(f"{estado.vasos}_{estado.eventos[-1].id if estado.eventos else 0}"
+                       for estado in estados.values())
+
+    def armar():
+        if since is not None:
+            eventos, truncado = eventos_nuevos(estados, since)
+        else:
+            eventos, truncado = eventos_recientes(estados), False
+        respuesta = conteo_vasos(estados)
+        respuesta["eventos"] = [evento.como_dict() for evento in eventos]
+        # Cursor para la próxima consulta con ?since=
+        ultimos = [estado.eventos[-1].id for estado in estados.values() if estado.eventos]
+        respuesta["since"] = max(ultimos + [since or 0])
+        respuesta["truncado"] = truncado
+        return respuesta
+    return version, armar
+
+@app.route("/stream")
+def stream():
+    if not session.get('autenticado'):
+        return jsonify({"error": "No autenticado"}), 401
+    if ver_todas():
+        lineas = list(LINEAS)
+    else:
+        linea = linea_solicitada()
+        if linea is None:
+            return linea_desconocida()
+        lineas = [linea.id]
+    suscripcion = DIFUSOR.suscribir(lineas)
+
+    def mensajes():
+        try:
+            yield f"retry: {STREAM_REINTENTO_MS}\n\n"
+            # Un cliente que se atrasa se corta; el navegador reconecta y recibe todo de nuevo
+            while not suscripcion.atrasada:
+                mensaje = suscripcion.siguiente(STREAM_LATIDO_S)
+                if mensaje is None:
+                    yield ": latido\n\n"
+                    continue
+                tipo, datos, _ = mensaje
+                yield f"event: {tipo}\ndata: {datos}\n\n"
+        finally:
+            DIFUSOR.cancelar(suscripcion)
+
+    return Response(mensajes(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def mensaje_ws(tipo, datos, valores, enviados):
+    # De los sensores solo viajan los campos que cambiaron desde el último envío
+    # a este navegador; el resto de los mensajes va con el JSON que armó el difusor
+    if tipo == 'datos':
+        anterior = enviados.get(valores['linea'], {})
+        cambios = {campo: valor for campo, valor in valores.items()
+                   if campo not in anterior or anterior[campo] != valor}
+        enviados[valores['linea']] = valores
+        return json.dumps({"tipo": tipo, "linea": valores['linea'], "cambios": cambios},
+                          ensure_ascii=False, separators=(',', ':'))
+    return f'{{"tipo":"{tipo}","datos":{datos}}}'
+
+def atender_comando(texto, suscripcion, lineas):
+    # {"id": 7, "cmd": "banda", "estado": "on", "linea": "linea1"}: el comando corre
+    # en otro hilo y la confirmación ('ack' con el mismo id) sale por el canal.
+    # Solo se aceptan las líneas del socket; "linea" es opcional si hay una sola
+    try:
+        pedido = json.loads(texto)
+    except (ValueError, TypeError):
+        pedido = None
+    if not isinstance(pedido, dict):
+        suscripcion.responder('ack', {"id": None, "ok": False, "message": "❌ Mensaje inválido"})
+        return
+    id_pedido = pedido.get('id')
+    estado = pedido.get('estado')
+    estado = estado.lower() if isinstance(estado, str) else None
+    id_linea = pedido.get('linea')
+    if id_linea is None and len(lineas) == 1:
+        id_linea = lineas[0]
+    if pedido.get('cmd') != 'banda' or estado not in ('on', 'off'):
+        suscripcion.responder('ack', {"id": id_pedido, "ok": False, "message": "❌ Comando inválido"})
+        return
+    if id_linea is None:
+        suscripcion.responder('ack', {"id": id_pedido, "ok": False, "message": "❌ Falta la línea del comando",
+                                      "lineas": lineas})
+        return
+    if id_linea not in lineas:
+        suscripcion.responder('ack', {"id": id_pedido, "ok": False, "message": "❌ Línea fuera de este canal",
+                                      "lineas": lineas})
+        return
+    linea = LINEAS[id_linea]
+
+    def confirmar(message):
+        suscripcion.responder('ack', {"id": id_pedido, "ok": message.startswith("✅"), "linea": linea.id,
+                                      "state": linea.led_state, "message": message})
+
+    # La confirmación sale apenas se escribe el comando, no tras las 3 repeticiones
+    if not linea.iniciar_comando(estado, confirmar):
+        suscripcion.responder('ack', {"id": id_pedido, "ok": False, "linea": linea.id,
+                                      "message": "❌ Hay otro comando en curso en la línea"})
+
+def canal_ws(ws):
+    if not session.get('autenticado'):
+        ws.send(json.dumps({"tipo": "error", "error": "No autenticado"}))
+        return
+    if ver_todas():
+        lineas = list(LINEAS)
+    else:
+        linea = linea_solicitada()
+        if linea is None:
+            ws.send(json.dumps({"tipo": "error", "error": "Línea desconocida", "lineas": list(LINEAS)}))
+            return
+        lineas = [linea.id]
+    suscripcion = DIFUSOR.suscribir(lineas)
+    abierto = threading.Event()
+    abierto.set()
+
+    def recibir():
+        try:
+            while True:
+                atender_comando(ws.receive(), suscripcion, lineas)
+        except ConnectionClosed:
+            pass
+        finally:
+            abierto.clear()
+    threading.Thread(target=recibir, daemon=True).start()
+
+    # Este hilo es el único que escribe en el socket
+    enviados = {}
+    try:
+        while abierto.is_set() and not suscripcion.atrasada:
+            mensaje = suscripcion.siguiente(WS_REVISION_S)
+            if mensaje is not None:
+                ws.send(mensaje_ws(*mensaje, enviados))
+    except ConnectionClosed:
+        pass
+    finally:
+        DIFUSOR.cancelar(suscripcion)
+
+if sock is not None:
+    sock.route("/ws")(canal_ws)
+
+def instante_parametro(nombre):
+    # Epoch en segundos o fecha ISO ("2024-05-01T08:00:00", hora local)
+    valor = request.args.get(nombre)
+    if not valor:
+        return None
+    try:
+        instante = float(valor)
+    except ValueError:
+        return datetime.fromisoformat(valor).timestamp()
+    # float() acepta "nan" e "inf": no son instantes y SQLite los compararía igual
+    if not math.isfinite(instante):
+        raise ValueError(f"{nombre} no es un instante: {valor}")
+    return instante
+
+def rango_invalido():
+    # Error 400 si ?desde= o ?hasta= no se pueden interpretar, None si están bien
+    try:
+        instante_parametro('desde')
+        instante_parametro('hasta')
+    except ValueError:
+        return jsonify({"error": "desde/hasta deben ser epoch o fecha ISO"}), 400
+    return None
+
+@app.route("/historial")
+def historial():
+    if not session.get('autenticado'):
+        return jsonify({"error": "No autenticado"}), 401
+    linea = linea_solicitada()
+    if linea is None:
+        return linea_desconocida()
+    
+    sensor = request.args.get('sensor', 'ULTRA').upper()
+    if sensor not in SENSORES_HISTORIAL:
+        return jsonify({"error": "Sensor sin historial", "sensores": list(SENSORES_HISTORIAL)}), 400
+    try:
+        desde = instante_parametro('desde')
+        hasta = instante_parametro('hasta')
+        puntos = min(int(request.args.get('puntos') or HISTORIAL_PUNTOS), HISTORIAL_PUNTOS)
+    except ValueError:
+        return jsonify({"error": "Parámetros inválidos: desde/hasta en epoch o ISO, puntos entero"}), 400
+    if puntos < 1:
+        return jsonify({"error": "puntos debe ser 1 o más"}), 400
+    
+    # Rangos largos salen de los resúmenes (min/max/media por intervalo), no de las muestras crudas;
+    # lo anterior al arranque o a lo que guarda la memoria, de los resúmenes por minuto en disco
+    corte = linea.historial.cobertura()
+    primero = None if desde is None or desde >= corte else RESUMENES.primero(linea.id, sensor)
+    if primero is None or primero >= corte:
+        # Nada en disco antes del corte: la memoria, desde lo que tiene
+        if desde is not None and desde < corte:
+            desde = corte
+        respuesta = linea.historial.consultar(sensor, desde, hasta, puntos)
+    elif hasta is not None and hasta <= corte:
+        respuesta = RESUMENES.consultar(linea.id, sensor, desde, hasta, puntos)
+    else:
+        # El rango cruza el corte: disco hasta el corte, memoria desde ahí, con
+        # los puntos repartidos según el tiempo de cada parte
+        desde = max(desde, primero)
+        fin = time.time() if hasta is None else hasta
+        puntos_disco = max(1, min(puntos - 1, round(puntos * (corte - desde) / (fin - desde))))
+        respuesta = unir_historial(RESUMENES.consultar(linea.id, sensor, desde, corte, puntos_disco),
+                                   linea.historial.consultar(sensor, corte, hasta, max(1, puntos - puntos_disco)))
+    respuesta.update(linea=linea.id, sensor=sensor)
+    return jsonify(respuesta)
+
+def unir_historial(anterior, reciente):
+    # Una respuesta detrás de la otra; solo quedan las columnas que tienen las dos
+    # (la memoria puede contestar con muestras crudas, que no traen min/max)
+    respuesta = {"resolucion": max(anterior["resolucion"], reciente["resolucion"])}
+    for columna, valores in anterior.items():
+        if columna != "resolucion" and columna in reciente:
+            respuesta[columna] = valores + reciente[columna]
+    return respuesta
+
+def estados_solicitados():
+    # Instantánea de cada línea pedida, tomada una sola vez por request
+    if ver_todas():
+        return {id_linea: linea.estado for id_linea, linea in LINEAS.items()}
+    linea = linea_solicitada()
+    return {linea.id: linea.estado}
+
+def eventos_solicitados(estados=None):
+    # Eventos de la línea pedida, o de todas ordenados por fecha.
+    # Con ?desde= o ?hasta= se leen del almacén en vez de la caché de recientes
+    if request.args.get('desde') or request.args.get('hasta'):
+        lineas = list(LINEAS) if ver_todas() else [linea_solicitada().id]
+        return ALMACEN.consultar(lineas, instante_parametro('desde'), instante_parametro('hasta'))
+    return eventos_recientes(estados or estados_solicitados())
+
+def eventos_recientes(estados):
+    # Caché de recientes de cada línea; con varias, ordenados por fecha
+    eventos = [evento for estado in estados.values() for evento in estado.eventos]
+    if len(estados) > 1:
+        eventos.sort(key=lambda evento: evento.t)
+    return eventos
+
+def entero_parametro(nombre):
+    valor = request.args.get(nombre)
+    return int(valor) if valor else None
+
+def eventos_nuevos(estados, since):
+    # Eventos de la caché con id mayor al cursor. Si la caché está llena y su
+    # evento más viejo ya es posterior al cursor, pudo haber eventos que no
+    # están: truncado=True y el panel vuelve a pedir la lista completa
+    eventos = []
+    truncado = False
+    for estado in estados.values():
+        if len(estado.eventos) == EVENTOS_RECIENTES and estado.eventos[0].id > since + 1:
+            truncado = True
+        eventos += [evento for evento in estado.eventos if evento.id > since]
+    if len(estados) > 1:
+        eventos.sort(key=lambda evento: evento.id)
+    return eventos, truncado
 
 @app.route("/reporte-llenados")
 def reporte_llenados():
     if not session.get('autenticado'):
         return jsonify({"error": "No autenticado"}), 401
-    
-    return jsonify({
-        "vasos": llenados_vasos,
-        "eventos": list(eventos_llenado)
-    })
+    error = rango_invalido()
+    if error:
+        return error
+    try:
+        since = entero_parametro('since')
+        before = entero_parametro('before')
+        limite = entero_parametro('limit')
+    except ValueError:
+        return jsonify({"error": "since, before y limit deben ser enteros"}), 400
+    if limite is None:
+        limite = EVENTOS_POR_PAGINA
+    elif limite < 1:
+        # SQLite toma LIMIT -1 como "sin límite"
+        return jsonify({"error": "limit debe ser 1 o más"}), 400
+    limite = min(limite, LIMITE_EVENTOS)
+    if since is not None and before is not None:
+        return jsonify({"error": "Usar since o before, no los dos"}), 400
+    if not ver_todas() and linea_solicitada() is None:
+        return linea_desconocida()
+    estados = estados_solicitados()
+
+    if before is not None:
+        # Página del historial guardado; "before" de la respuesta pide la siguiente (None: no hay más)
+        eventos = ALMACEN.anteriores(list(estados), before, limite)
+        return jsonify({
+            "eventos": [evento.como_dict() for evento in eventos],
+            "before": eventos[0].id if len(eventos) == limite else None
+        })
+
+    if request.args.get('desde') or request.args.get('hasta'):
+        # Un rango sale de SQLite, que se escribe por lotes: sin versión confiable
+        respuesta = conteo_vasos(estados)
+        respuesta["eventos"] = [evento.como_dict() for evento in eventos_solicitados(estados)]
+        return jsonify(respuesta)
+    return respuesta_versionada(*seccion_reporte(estados, since))
+
+@app.route("/estado-completo")
+def estado_completo():
+    # Todo el panel en una consulta: ?secciones=datos,conexion,reporte (por defecto
+    # todas) y, por sección, la versión que ya tiene el navegador (?datos=<versión>...).
+    # Las secciones sin cambios no se mandan; "versiones" trae siempre las actuales.
+    # El reporte sale de la caché de recientes: para rangos, /reporte-llenados?desde=
+    if not session.get('autenticado'):
+        return jsonify({"error": "No autenticado"}), 401
+    pedidas = request.args.get('secciones')
+    secciones = pedidas.split(',') if pedidas else list(SECCIONES_PANEL)
+    if any(seccion not in SECCIONES_PANEL for seccion in secciones):
+        return jsonify({"error": "Sección desconocida", "secciones": list(SECCIONES_PANEL)}), 400
+    try:
+        since = entero_parametro('since')
+    except ValueError:
+        return jsonify({"error": "since debe ser entero"}), 400
+    if not ver_todas() and linea_solicitada() is None:
+        return linea_desconocida()
+
+    constructores = {
+        'datos': seccion_datos,
+        'conexion': seccion_conexion,
+        'reporte': lambda: seccion_reporte(estados_solicitados(), since),
+    }
+    respuesta = {"versiones": {}}
+    for seccion in secciones:
+        version, armar = constructores[seccion]()
+        version = f"{ARRANQUE}-{version}"
+        respuesta["versiones"][seccion] = version
+        if request.args.get(seccion) != version:
+            respuesta[seccion] = armar()
+    return jsonify(respuesta)
 
 # ============= RUTA PARA EXPORTAR DATOS =============
 @app.route("/exportar-csv")
 def exportar_csv():
     if not session.get('autenticado'):
         return redirect('/login')
+    if not ver_todas() and linea_solicitada() is None:
+        return linea_desconocida()
+    error = rango_invalido()
+    if error:
+        return error
+    todas = ver_todas()
     
     # Crear un archivo CSV en memoria
     output = io.StringIO()
     writer = csv.writer(output)
     
     # Escribir encabezados
-    writer.writerow(['Tipo', 'Estado', 'Timestamp', 'Nivel', 'Temperatura'])
+    encabezados = ['Tipo', 'Estado', 'Timestamp', 'Nivel', 'Temperatura']
+    writer.writerow(['Línea'] + encabezados if todas else encabezados)
     
     # Escribir datos
-    for evento in eventos_llenado:
-        writer.writerow([
-            evento['tipo'],
-            evento['estado'],
-            evento['timestamp'],
-            evento['nivel'],
-            evento['temp']
-        ])
+    for evento in eventos_solicitados():
+        fila = [
+            evento.tipo,
+            evento.estado,
+            evento.timestamp,
+            evento.nivel,
+            evento.temperatura
+        ]
+        writer.writerow([evento.linea] + fila if todas else fila)
     
     # Preparar respuesta para descarga
     output.seek(0)
@@ -1638,6 +2072,12 @@ def exportar_csv():
 def exportar_pdf():
     if not session.get('autenticado'):
         return redirect('/login')
+    if not ver_todas() and linea_solicitada() is None:
+        return linea_desconocida()
+    error = rango_invalido()
+    if error:
+        return error
+    todas = ver_todas()
     
     # Crear PDF
     pdf = FPDF()
@@ -1648,21 +2088,31 @@ def exportar_pdf():
     pdf.cell(200, 10, txt="Reporte de Eventos de Llenado", ln=1, align='C')
     pdf.ln(10)
     
+    # Anchos de columna: con todas las líneas se agrega la columna "Línea"
+    if todas:
+        anchos = {'linea': 20, 'tipo': 20, 'estado': 40, 'timestamp': 45, 'nivel': 25, 'temp': 40}
+    else:
+        anchos = {'tipo': 20, 'estado': 50, 'timestamp': 50, 'nivel': 25, 'temp': 45}
+    
     # Encabezados de tabla
     pdf.set_font("Arial", 'B', 12)
-    pdf.cell(20, 10, "Tipo", 1, 0, 'C')
-    pdf.cell(50, 10, "Estado", 1, 0, 'C')
-    pdf.cell(50, 10, "Timestamp", 1, 0, 'C')
-    pdf.cell(25, 10, "Nivel", 1, 0, 'C')
-    pdf.cell(45, 10, "Temperatura", 1, 1, 'C')
+    if todas:
+        pdf.cell(anchos['linea'], 10, "Línea", 1, 0, 'C')
+    pdf.cell(anchos['tipo'], 10, "Tipo", 1, 0, 'C')
+    pdf.cell(anchos['estado'], 10, "Estado", 1, 0, 'C')
+    pdf.cell(anchos['timestamp'], 10, "Timestamp", 1, 0, 'C')
+    pdf.cell(anchos['nivel'], 10, "Nivel", 1, 0, 'C')
+    pdf.cell(anchos['temp'], 10, "Temperatura", 1, 1, 'C')
     
     pdf.set_font("Arial", size=10)
-    for evento in eventos_llenado:
-        pdf.cell(20, 10, evento['tipo'], 1, 0, 'C')
-        pdf.cell(50, 10, evento['estado'], 1, 0, 'C')
-        pdf.cell(50, 10, evento['timestamp'], 1, 0, 'C')
-        pdf.cell(25, 10, evento['nivel'], 1, 0, 'C')
-        pdf.cell(45, 10, evento['temp'], 1, 1, 'C')
+    for evento in eventos_solicitados():
+        if todas:
+            pdf.cell(anchos['linea'], 10, evento.linea, 1, 0, 'C')
+        pdf.cell(anchos['tipo'], 10, evento.tipo, 1, 0, 'C')
+        pdf.cell(anchos['estado'], 10, evento.estado, 1, 0, 'C')
+        pdf.cell(anchos['timestamp'], 10, evento.timestamp, 1, 0, 'C')
+        pdf.cell(anchos['nivel'], 10, evento.nivel, 1, 0, 'C')
+        pdf.cell(anchos['temp'], 10, evento.temperatura, 1, 1, 'C')
     
     # Preparar respuesta
     fecha = datetime.now().strftime("%Y-%m-%d_%H-%M")
@@ -1673,11 +2123,43 @@ def exportar_pdf():
         headers={"Content-Disposition": f"attachment;filename=reporte_llenados_{fecha}.pdf"}
     )
 
+# ============= RUTA PARA EXPORTAR EL ARCHIVO COLUMNAR =============
+# /exportar-archivo?tipo=telemetria|eventos&desde=AAAA-MM-DD&hasta=AAAA-MM-DD&formato=parquet|arrow
+# Solo días ya compactados (hasta ayer). La respuesta se envía a medida que se leen los lotes.
+@app.route("/exportar-archivo")
+def exportar_archivo():
+    if not session.get('autenticado'):
+        return redirect('/login')
+    if not archivo.disponible():
+        return jsonify({"error": "Archivo columnar no disponible: falta pyarrow"}), 501
+    if not ver_todas() and linea_solicitada() is None:
+        return linea_desconocida()
+    
+    tipo = request.args.get('tipo', 'telemetria')
+    formato = request.args.get('formato', 'parquet')
+    try:
+        desde = datetime.strptime(request.args['desde'], "%Y-%m-%d").date()
+        hasta = datetime.strptime(request.args.get('hasta') or request.args['desde'], "%Y-%m-%d").date()
+    except (KeyError, ValueError):
+        return jsonify({"error": "desde/hasta deben ser fechas AAAA-MM-DD"}), 400
+    if tipo not in archivo.TIPOS_ARCHIVO or formato not in archivo.FORMATOS_ARCHIVO:
+        return jsonify({"error": "Parámetros inválidos", "tipos": list(archivo.TIPOS_ARCHIVO),
+                        "formatos": list(archivo.FORMATOS_ARCHIVO)}), 400
+    
+    lineas = None if ver_todas() else [linea_solicitada().id]
+    extension, mimetype = {
+        'parquet': ('parquet', 'application/vnd.apache.parquet'),
+        'arrow': ('arrows', 'application/vnd.apache.arrow.stream'),
+    }[formato]
+    return Response(
+        archivo.exportar(DIRECTORIO_ARCHIVO, tipo, desde, hasta, formato, lineas),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment;filename={tipo}_{desde}_{hasta}.{extension}"}
+    )
+
 # ============= INICIO DEL SISTEMA =============
 if __name__ == "__main__":
-    threading.Thread(target=conectar_arduino, daemon=True).start()
-    time.sleep(1)
-    threading.Thread(target=leer_serial, daemon=True).start()
+    iniciar()
     
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
@@ -1696,6 +2178,9 @@ if __name__ == "__main__":
     print(f"   Local:  http://localhost:5000")
     print(f"   Red:    http://{local_ip}:5000")
     print(f"{'-'*60}")
+    print(f"🧩 Decodificador JSON: {BACKEND_JSON} | Ingesta: {MODO_INGESTA}")
+    memoria_historial = sum(linea.historial.memoria() for linea in LINEAS.values())
+    print(f"📈 Historial: {HISTORIAL_HORAS} h a {HISTORIAL_HZ} Hz, {memoria_historial / 1e6:.1f} MB reservados")
     print(f"⚠️ Conectando a Arduino...")
     print(f"   Si tienes problemas, verifica el puerto serial")
     print(f"{'='*60}\n")
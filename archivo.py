@@ -0,0 +1,337 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+# pyarrow es opcional: sin él no hay archivo columnar, el resto funciona igual
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+import bitacora
+from retencion import Limitador, bajar_prioridad
+from eventos import ESTADOS_EVENTO, EventoLlenado
+from tramas import parsear_linea
+
+# ============= ARCHIVO COLUMNAR DIARIO =============
+# Un hilo compacta cada día ya cerrado en archivos Parquet con columnas tipadas:
+#   <directorio>/telemetria/AAAA-MM-DD.parquet   una fila por trama de la bitácora
+#   <directorio>/eventos/AAAA-MM-DD.parquet      una fila por evento de llenado
+# La línea y el estado van con codificación de diccionario. Las exportaciones
+# leen los días pedidos por lotes y los van enviando, sin armar todo en memoria.
+TIPOS_ARCHIVO = ('telemetria', 'eventos')
+FORMATOS_ARCHIVO = ('parquet', 'arrow')
+FILAS_POR_LOTE = 65536
+REVISION_S = 3600  # cada cuánto se buscan días sin compactar
+
+if pa is not None:
+    _LINEA = pa.dictionary(pa.int16(), pa.string())
+    ESQUEMAS = {
+        'telemetria': pa.schema([
+            ('t', pa.timestamp('us', tz='UTC')),
+            ('linea', _LINEA),
+            ('ir', pa.int8()),
+            ('ultra', pa.float32()),
+            ('temp', pa.float32()),
+            ('bomba', pa.bool_()),
+        ]),
+        'eventos': pa.schema([
+            ('id', pa.int64()),
+            ('t', pa.timestamp('us', tz='UTC')),
+            ('linea', _LINEA),
+            ('estado', pa.dictionary(pa.int8(), pa.string())),
+            ('ultra', pa.float32()),
+            ('temp', pa.float32()),
+        ]),
+    }
+    COLUMNAS_DICCIONARIO = {'telemetria': ['linea'], 'eventos': ['linea', 'estado']}
+
+
+def disponible():
+    return pa is not None
+
+
+def _limites_dia(dia):
+    # Epoch del inicio y del fin del día en hora local
+    inicio = time.mktime(dia.timetuple())
+    return inicio, time.mktime((dia + timedelta(days=1)).timetuple())
+
+
+def _diccionario(indices, valores, tipo):
+    return pa.DictionaryArray.from_arrays(pa.array(indices, tipo.index_type), pa.array(valores, pa.string()))
+
+
+# ---------- Compactación ----------
+def _lotes_telemetria(directorios, inicio, fin, limitador=None):
+    # directorios: {id de línea: directorio de su bitácora}. Un lote junta
+    # hasta FILAS_POR_LOTE tramas: la pausa va cada 256, como en retencion.resumir_segmento
+    ids = list(directorios)
+    for indice, id_linea in enumerate(ids):
+        directorio = directorios[id_linea]
+        if not os.path.isdir(directorio):
+            continue
+        columnas = ([], [], [], [], [])
+        leidas = 0
+        bytes_leidos = 0
+        for t, trama in bitacora.leer_tramas(directorio, inicio, fin):
+            if t >= fin:
+                break
+            leidas += 1
+            bytes_leidos += len(trama) + 10
+            if limitador is not None and leidas % 256 == 0:
+                limitador.pausa(bytes_leidos)
+                bytes_leidos = 0
+            trama = parsear_linea(bytes(trama))
+            if trama is None:
+                continue  # respuestas de comandos (BANDA:ON...) y otras líneas sin sensores
+            columnas[0].append(int(t * 1e6))
+            columnas[1].append(trama.ir)
+            columnas[2].append(trama.ultra)
+            columnas[3].append(trama.temp)
+            columnas[4].append(trama.bomba)
+            if len(columnas[0]) >= FILAS_POR_LOTE:
+                yield _lote_telemetria(columnas, indice, ids)
+                columnas = ([], [], [], [], [])
+        if columnas[0]:
+            yield _lote_telemetria(columnas, indice, ids)
+
+
+def _lote_telemetria(columnas, indice, ids):
+    esquema = ESQUEMAS['telemetria']
+    tiempos, ir, ultra, temp, bomba = columnas
+    return pa.record_batch([
+        pa.array(tiempos, pa.int64()).cast(esquema.field('t').type),
+        _diccionario([indice] * len(tiempos), ids, _LINEA),
+        pa.array(ir, pa.int8()),
+        pa.array(ultra, pa.float32()),
+        pa.array(temp, pa.float32()),
+        pa.array(bomba, pa.bool_()),
+    ], schema=esquema)
+
+
+def _lotes_eventos(ruta_eventos, inicio, fin):
+    if not os.path.exists(ruta_eventos):
+        return
+    esquema = ESQUEMAS['eventos']
+    codigos = list(ESTADOS_EVENTO)
+    estados = [ESTADOS_EVENTO[codigo] for codigo in codigos]
+    conexion = sqlite3.connect(f"file:{ruta_eventos}?mode=ro", uri=True)
+    try:
+        cursor = conexion.execute("SELECT * FROM eventos WHERE t >= ? AND t < ? ORDER BY t, id", (inicio, fin))
+        while True:
+            filas = [EventoLlenado.desde_fila(fila) for fila in cursor.fetchmany(FILAS_POR_LOTE)]
+            if not filas:
+                return
+            lineas = sorted({evento.linea for evento in filas})
+            posicion = {linea: i for i, linea in enumerate(lineas)}
+            yield pa.record_batch([
+                pa.array([evento.id for evento in filas], pa.int64()),
+                pa.array([int(evento.t * 1e6) for evento in filas], pa.int64()).cast(esquema.field('t').type),
+                _diccionario([posicion[evento.linea] for evento in filas], lineas, _LINEA),
+                _diccionario([codigos.index(evento.codigo) for evento in filas], estados,
+                             esquema.field('estado').type),
+                pa.array([evento.ultra for evento in filas], pa.float32()),
+                pa.array([evento.temp for evento in filas], pa.float32()),
+            ], schema=esquema)
+    finally:
+        conexion.close()
+
+
+def ruta_dia(directorio, tipo, dia):
+    return os.path.join(directorio, tipo, f"{dia.isoformat()}.parquet")
+
+
+def archivado(directorio, tipo, inicio, fin):
+    # ¿Ya están compactados todos los días (hora local) que toca [inicio, fin)?
+    dia = date.fromtimestamp(inicio)
+    ultimo = date.fromtimestamp(max(inicio, fin - 1))
+    while dia <= ultimo:
+        if not os.path.exists(ruta_dia(directorio, tipo, dia)):
+            return False
+        dia += timedelta(days=1)
+    return True
+
+
+def compactar_dia(directorio, tipo, dia, directorios_bitacora, ruta_eventos, limitador=None):
+    inicio, fin = _limites_dia(dia)
+    if tipo == 'telemetria':
+        lotes = _lotes_telemetria(directorios_bitacora, inicio, fin, limitador)
+    else:
+        lotes = _lotes_eventos(ruta_eventos, inicio, fin)
+
+    ruta = ruta_dia(directorio, tipo, dia)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + '.tmp'
+    filas = 0
+    # Un día sin datos deja igual su archivo (vacío) para no revisarlo de nuevo
+    with pq.ParquetWriter(temporal, ESQUEMAS[tipo], compression='zstd') as escritor:
+        for lote in lotes:
+            escritor.write_batch(lote)
+            filas += lote.num_rows
+            if limitador is not None:
+                limitador.pausa(lote.nbytes)
+    os.replace(temporal, ruta)
+    return filas
+
+
+def _primer_dia(directorios_bitacora, ruta_eventos):
+    inicios = []
+    for directorio in directorios_bitacora.values():
+        if os.path.isdir(directorio):
+            lista = bitacora.segmentos(directorio)
+            if lista:
+                inicios.append(lista[0][0])
+    if os.path.exists(ruta_eventos):
+        conexion = sqlite3.connect(f"file:{ruta_eventos}?mode=ro", uri=True)
+        try:
+            primero = conexion.execute("SELECT MIN(t) FROM eventos").fetchone()[0]
+        except sqlite3.Error:
+            primero = None
+        finally:
+            conexion.close()
+        if primero is not None:
+            inicios.append(primero)
+    return date.fromtimestamp(min(inicios)) if inicios else None
+
+
+def compactar_pendientes(directorio, directorios_bitacora, ruta_eventos, limitador=None):
+    # Compacta los días cerrados (hasta ayer) que todavía no tienen archivo
+    dia = _primer_dia(directorios_bitacora, ruta_eventos)
+    if dia is None:
+        return []
+    hechos = []
+    hoy = date.today()
+    while dia < hoy:
+        for tipo in TIPOS_ARCHIVO:
+            if not os.path.exists(ruta_dia(directorio, tipo, dia)):
+                filas = compactar_dia(directorio, tipo, dia, directorios_bitacora, ruta_eventos, limitador)
+                hechos.append((tipo, dia, filas))
+        dia += timedelta(days=1)
+    return hechos
+
+
+class CompactadorDiario:
+    def __init__(self, directorio, directorios_bitacora, ruta_eventos, revision=REVISION_S):
+        self.directorio = directorio
+        self.directorios_bitacora = directorios_bitacora
+        self.ruta_eventos = ruta_eventos
+        self.revision = revision
+        self.limitador = Limitador()
+
+    def iniciar(self):
+        threading.Thread(target=self._compactar_periodicamente, daemon=True).start()
+
+    def _compactar_periodicamente(self):
+        # Mismos límites que el mantenimiento: no competir con la lectura serial
+        bajar_prioridad()
+        while True:
+            try:
+                for tipo, dia, filas in compactar_pendientes(self.directorio, self.directorios_bitacora,
+                                                             self.ruta_eventos, self.limitador):
+                    print(f"🗄️ Archivo {tipo} {dia}: {filas} filas")
+            except Exception as e:
+                print(f"[ERROR] Compactando archivo columnar: {str(e)}")
+            time.sleep(self.revision)
+
+
+# ---------- Exportación ----------
+class _Trozos:
+    # Destino de escritura para pyarrow que junta lo escrito hasta que se envía
+    closed = False
+
+    def __init__(self):
+        self.trozos = []
+
+    def write(self, datos):
+        self.trozos.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self.trozos)
+        self.trozos.clear()
+        return datos
+
+
+def exportar(directorio, tipo, desde, hasta, formato='parquet', lineas=None):
+    # Genera el archivo por partes (bytes) con los días [desde, hasta] ya compactados
+    esquema = ESQUEMAS[tipo]
+    trozos = _Trozos()
+    destino = pa.PythonFile(trozos, mode='w')
+    if formato == 'parquet':
+        escritor = pq.ParquetWriter(destino, esquema, compression='zstd')
+    else:
+        escritor = pa.ipc.new_stream(destino, esquema)
+    filtro = pa.array(lineas, pa.string()) if lineas else None
+
+    dia = desde
+    while dia <= hasta:
+        ruta = ruta_dia(directorio, tipo, dia)
+        dia += timedelta(days=1)
+        if not os.path.exists(ruta):
+            continue
+        archivo = pq.ParquetFile(ruta, read_dictionary=COLUMNAS_DICCIONARIO[tipo])
+        for lote in archivo.iter_batches(batch_size=FILAS_POR_LOTE):
+            if filtro is not None:
+                lote = lote.filter(pc.is_in(lote.column('linea').cast(pa.string()), value_set=filtro))
+            if lote.num_rows:
+                # Al leer, los índices de diccionario vuelven como int32: volver al esquema del archivo
+                escritor.write_table(pa.Table.from_batches([lote]).cast(esquema))
+                yield trozos.vaciar()
+    escritor.close()
+    yield trozos.vaciar()
+
+
+# ============= LÍNEA DE COMANDOS =============
+def _dia(valor):
+    return datetime.strptime(valor, "%Y-%m-%d").date()
+
+
+def main():
+    base = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Archivo columnar diario (Parquet / Arrow)")
+    parser.add_argument('--directorio', default=os.path.join(base, 'archivo'))
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    compactar = sub.add_parser('compactar', help="compactar ya los días cerrados pendientes")
+    compactar.add_argument('--tramas', default=os.path.join(base, 'tramas'),
+                           help="directorio de la bitácora (un subdirectorio por línea)")
+    compactar.add_argument('--eventos', default=os.path.join(base, 'eventos.db'))
+
+    exportar_cmd = sub.add_parser('exportar', help="exportar un rango de días")
+    exportar_cmd.add_argument('tipo', choices=TIPOS_ARCHIVO)
+    exportar_cmd.add_argument('--desde', type=_dia, required=True, help="AAAA-MM-DD")
+    exportar_cmd.add_argument('--hasta', type=_dia, required=True, help="AAAA-MM-DD")
+    exportar_cmd.add_argument('--formato', choices=FORMATOS_ARCHIVO, default='parquet')
+    exportar_cmd.add_argument('--linea', action='append', help="filtrar por línea (se puede repetir)")
+    exportar_cmd.add_argument('salida')
+    args = parser.parse_args()
+
+    if not disponible():
+        parser.exit(1, "❌ Falta pyarrow: pip install pyarrow\n")
+
+    if args.comando == 'compactar':
+        directorios = {}
+        if os.path.isdir(args.tramas):
+            directorios = {nombre: os.path.join(args.tramas, nombre) for nombre in sorted(os.listdir(args.tramas))}
+        for tipo, dia, filas in compactar_pendientes(args.directorio, directorios, args.eventos):
+            print(f"🗄️ {tipo} {dia}: {filas} filas")
+        return
+
+    total = 0
+    with open(args.salida, 'wb') as salida:
+        for datos in exportar(args.directorio, args.tipo, args.desde, args.hasta, args.formato, args.linea):
+            salida.write(datos)
+            total += len(datos)
+    print(f"💾 {args.salida}: {total / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
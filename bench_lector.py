@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import pty
+import threading
+import time
+import tty
+
+import serial
+
+from lineas import LineaLlenado
+
+# ============= BENCHMARK DEL LECTOR SERIAL =============
+# Tramas por segundo y latencia desde que la trama se escribe en el puerto
+# hasta que aparece en el estado, con el lector original (in_waiting + una
+# línea + sleep(0.1)) y con el actual (LineaLlenado: lectura bloqueante que
+# vacía el buffer + hilo de procesamiento). El puerto es un pseudo-terminal
+# y cada trama lleva su número en ULTRA para saber cuándo llegó.
+# Uso: python bench_lector.py [--lector original|actual] [--frecuencia 200] [--tramas 2000]
+ESPERA_FINAL_S = 1.5  # tiempo para que el lector termine lo que quedó en el buffer
+
+
+def lector_original(puerto, estado):
+    # El leer_serial de antes, reducido a la lectura y al parseo JSON
+    while True:
+        if puerto.in_waiting > 0:
+            linea = puerto.readline().decode('utf-8', errors='ignore').strip()
+            if linea.startswith('{') and linea.endswith('}'):
+                estado["ULTRA"] = json.loads(linea)["ULTRA"]
+        time.sleep(0.1)
+
+
+def escribir_tramas(maestro, frecuencia, cantidad, escritas):
+    # Como el Arduino, no espera a nadie: si el buffer del sistema está lleno la trama se pierde
+    os.set_blocking(maestro, False)
+    periodo = 1 / frecuencia
+    inicio = time.perf_counter()
+    for i in range(cantidad):
+        escritas[i] = time.perf_counter()
+        try:
+            os.write(maestro, json.dumps({"IR": 1, "ULTRA": i, "TEMP": 24.5, "BOMBA": "OFF"}).encode() + b"\n")
+        except BlockingIOError:
+            del escritas[i]
+        espera = inicio + (i + 1) * periodo - time.perf_counter()
+        if espera > 0:
+            time.sleep(espera)
+
+
+def observar(leer_ultra, vistas, detener):
+    # Anota cuándo aparece cada número de trama en el estado
+    ultimo = None
+    while not detener.is_set():
+        ultra = leer_ultra()
+        if ultra is not None and ultra != ultimo:
+            ultimo = ultra
+            vistas[int(ultra)] = time.perf_counter()
+        time.sleep(0.0002)
+
+
+def medir(lector, frecuencia, cantidad):
+    maestro, esclavo = pty.openpty()
+    tty.setraw(esclavo)
+    puerto = serial.Serial(os.ttyname(esclavo), 115200, timeout=1)
+
+    if lector == 'original':
+        estado = {"ULTRA": None}
+        threading.Thread(target=lector_original, args=(puerto, estado), daemon=True).start()
+        leer_ultra = lambda: estado["ULTRA"]
+    else:
+        linea = LineaLlenado("bench", puerto.port, puerto_alternativo=False)
+        linea.arduino = puerto
+        threading.Thread(target=linea.leer_serial, daemon=True).start()
+        threading.Thread(target=linea.procesar_tramas, daemon=True).start()
+        leer_ultra = lambda: linea.estado.ultra
+
+    escritas, vistas = {}, {}
+    detener = threading.Event()
+    threading.Thread(target=observar, args=(leer_ultra, vistas, detener), daemon=True).start()
+    inicio = time.perf_counter()
+    escribir_tramas(maestro, frecuencia, cantidad, escritas)
+    time.sleep(ESPERA_FINAL_S)
+    detener.set()
+
+    # El estado solo guarda la última trama: entre las escritas, las anteriores
+    # a la más alta vista ya pasaron por el lector
+    ultima = max(vistas) if vistas else -1
+    procesadas = sum(1 for i in escritas if i <= ultima)
+    duracion = max(vistas.values()) - inicio if vistas else 0
+    latencias = sorted(vistas[i] - escritas[i] for i in vistas)
+    return {
+        "perdidas": cantidad - len(escritas),
+        "procesadas": procesadas,
+        "tramas_s": procesadas / duracion if duracion else 0,
+        "p50_ms": latencias[len(latencias) // 2] * 1000 if latencias else None,
+        "p99_ms": latencias[int(len(latencias) * 0.99)] * 1000 if latencias else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lector serial original contra el actual")
+    parser.add_argument('--lector', choices=('original', 'actual'), action='append',
+                        help="uno o los dos (por defecto los dos)")
+    parser.add_argument('--frecuencia', type=float, default=200, help="tramas por segundo ofrecidas")
+    parser.add_argument('--tramas', type=int, default=2000)
+    args = parser.parse_args()
+
+    for lector in args.lector or ('original', 'actual'):
+        r = medir(lector, args.frecuencia, args.tramas)
+        print(f"📈 {lector}: {r['procesadas']}/{args.tramas} tramas a {args.frecuencia:.0f}/s ofrecidas "
+              f"({r['perdidas']} perdidas con el buffer lleno) -> {r['tramas_s']:.0f} tramas/s, latencia p50 {r['p50_ms']:.2f} ms, p99 {r['p99_ms']:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
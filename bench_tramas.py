@@ -0,0 +1,54 @@
+import argparse
+import json
+import re
+import timeit
+
+from tramas import BACKEND_JSON, parsear_linea
+
+# ============= MICRO-BENCHMARK DEL PARSER =============
+# Compara parsear_linea() con el camino que seguía cada línea en el leer_serial
+# original: decodificar a texto, intentar json.loads y, si fallaba, re.match con
+# el patrón sin compilar más split(',') y split(':') por campo.
+# Uso: python bench_tramas.py [--repeticiones 200000]
+LINEAS = {
+    'legado': b'IR:0,ULTRA:12.3,TEMP:24.5,BOMBA:1',
+    'json': b'{"IR":0,"ULTRA":12.3,"TEMP":24.5,"BOMBA":"ON"}',
+}
+
+
+def parsear_original(linea):
+    # Mismos pasos que el código anterior, sin tocar el estado global
+    linea = linea.decode('utf-8', errors='ignore').strip()
+    try:
+        data = json.loads(linea)
+        return data.get("IR", 1), data.get("ULTRA", 0), float(data.get("TEMP", 0)), data.get("BOMBA", "OFF") == "ON"
+    except json.JSONDecodeError:
+        if not re.match(r'IR:\d+,ULTRA:\d+\.?\d*,TEMP:\d+\.?\d*,BOMBA:[01]', linea):
+            return None
+        campos = {}
+        for parte in linea.split(','):
+            if ':' in parte:
+                clave, valor = parte.split(':')
+                campos[clave.strip()] = valor
+        return int(campos["IR"]), float(campos["ULTRA"]), float(campos["TEMP"]), campos["BOMBA"] == "1"
+
+
+def medir(funcion, linea, repeticiones):
+    # Mejor de 5 rondas, en microsegundos por trama
+    return min(timeit.repeat(lambda: funcion(linea), number=repeticiones, repeat=5)) / repeticiones * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parser de tramas: original contra tramas.parsear_linea")
+    parser.add_argument('--repeticiones', type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"🧪 Backend JSON: {BACKEND_JSON}")
+    for formato, linea in LINEAS.items():
+        antes = medir(parsear_original, linea, args.repeticiones)
+        despues = medir(parsear_linea, linea, args.repeticiones)
+        print(f"📈 {formato}: original {antes:.2f} µs/trama, nuevo {despues:.2f} µs/trama ({antes / despues:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+import argparse
+import gzip
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+from bisect import bisect_left
+
+# ============= BITÁCORA DE TRAMAS CRUDAS =============
+# Todo lo que manda el Arduino, tal como llegó, para diagnosticar la llenadora.
+# Por línea, un directorio con segmentos que solo crecen:
+#   <inicio_ms>.seg     registros: t f64 (epoch) | largo u16 | trama
+#   <inicio_ms>.idx     índice disperso: (t f64, posición u64) cada PASO_INDICE bytes
+# El segmento rota por tamaño o por antigüedad; al cerrarse se comprime en un
+# hilo aparte (<inicio_ms>.seg.gz) y el índice sigue valiendo con las
+# posiciones sin comprimir.
+# Como en eventos.AlmacenEventos, el lector solo deja el lote en una lista en
+# memoria y un hilo escritor por bitácora escribe, rota y vuelca: la lectura
+# serial nunca espera al disco. Si el disco no da abasto, la lista llega a
+# PENDIENTES_MAX tramas y las siguientes se descartan (quedan contadas).
+SEGMENTO_BYTES = 64 * 1024 * 1024
+SEGMENTO_S = 3600
+PASO_INDICE = 64 * 1024
+VOLCADO_S = 1.0  # cada cuánto se pasa el buffer al archivo
+LOTE_VOLCADO = 4096  # tramas pendientes que despiertan antes al escritor
+PENDIENTES_MAX = 50000
+
+_REGISTRO = struct.Struct('<dH')
+_INDICE = struct.Struct('<dQ')
+
+
+class BitacoraTramas:
+    def __init__(self, directorio, tamano_segmento=SEGMENTO_BYTES, duracion_segmento=SEGMENTO_S):
+        self.directorio = directorio
+        self.tamano_segmento = tamano_segmento
+        self.duracion_segmento = duracion_segmento
+        os.makedirs(directorio, exist_ok=True)
+
+        self._archivo = None
+        self._indice = None
+        self._ruta = None
+        self._inicio = 0.0
+        self._posicion = 0
+        self._ultimo_indice = -PASO_INDICE
+        self._pendientes = []
+        self._en_cola = 0  # tramas en _pendientes
+        self._condicion = threading.Condition()
+        self._escritura = threading.Lock()  # un solo escritor de archivos a la vez
+        self._detenido = False
+        self.activa = True
+        self.registros = 0
+        self.segmentos = 0
+        self.descartadas = 0
+
+        # Segmentos de una ejecución anterior que quedaron sin comprimir
+        for nombre in sorted(os.listdir(directorio)):
+            if nombre.endswith('.seg'):
+                self._comprimir_en_segundo_plano(os.path.join(directorio, nombre))
+
+        self._hilo = threading.Thread(target=self._escribir, daemon=True)
+        self._hilo.start()
+
+    def agregar_lote(self, t, tramas):
+        # Todas las tramas de una misma lectura comparten el tiempo de recepción
+        if not tramas or not self.activa:
+            return
+        with self._condicion:
+            if self._en_cola + len(tramas) > PENDIENTES_MAX:
+                self.descartadas += len(tramas)
+                return
+            self._pendientes.append((t, tramas))
+            self._en_cola += len(tramas)
+            if self._en_cola >= LOTE_VOLCADO:
+                self._condicion.notify()
+
+    def volcar(self):
+        # Escribe lo pendiente y pasa el buffer al archivo (para leer el segmento activo)
+        with self._escritura:
+            with self._condicion:
+                lotes, self._pendientes = self._pendientes, []
+                self._en_cola = 0
+            if not self.activa:
+                return
+            try:
+                for t, tramas in lotes:
+                    self._escribir_lote(t, tramas)
+                if self._archivo is not None:
+                    self._archivo.flush()
+                    self._indice.flush()
+            except OSError as e:
+                # Sin disco no se deja de leer el puerto: se apaga la bitácora
+                print(f"[ERROR] Bitácora de tramas {self.directorio} desactivada: {str(e)}")
+                self.activa = False
+
+    def detener(self):
+        # Escribe lo pendiente y termina el hilo escritor
+        with self._condicion:
+            self._detenido = True
+            self._condicion.notify()
+        self._hilo.join()
+
+    def _escribir(self):
+        while True:
+            with self._condicion:
+                self._condicion.wait_for(lambda: self._en_cola >= LOTE_VOLCADO or self._detenido,
+                                         VOLCADO_S)
+                detenido = self._detenido
+            self.volcar()
+            if detenido or not self.activa:
+                return
+
+    def estadisticas(self):
+        with self._condicion:
+            pendientes = self._en_cola
+        return {"activa": self.activa, "pendientes": pendientes, "registros": self.registros,
+                "segmentos": self.segmentos, "descartadas": self.descartadas}
+
+    def _escribir_lote(self, t, tramas):
+        if self._archivo is None or self._posicion >= self.tamano_segmento \
+                or t - self._inicio >= self.duracion_segmento:
+            self._rotar(t)
+
+        if self._posicion - self._ultimo_indice >= PASO_INDICE:
+            self._indice.write(_INDICE.pack(t, self._posicion))
+            self._ultimo_indice = self._posicion
+
+        cabecera = _REGISTRO.pack
+        partes = []
+        for trama in tramas:
+            partes.append(cabecera(t, len(trama)))
+            partes.append(trama)
+        datos = b''.join(partes)
+        self._archivo.write(datos)
+        self._posicion += len(datos)
+        self.registros += len(tramas)
+
+    def cerrar(self):
+        if self._archivo is None:
+            return
+        self._archivo.close()
+        self._indice.close()
+        self._archivo = None
+        self._comprimir_en_segundo_plano(self._ruta)
+
+    def _rotar(self, t):
+        self.cerrar()
+        base = os.path.join(self.directorio, f"{int(t * 1000):015d}")
+        self._ruta = base + '.seg'
+        self._archivo = open(self._ruta, 'ab', buffering=1024 * 1024)
+        self._indice = open(base + '.idx', 'ab')
+        self._inicio = t
+        self._posicion = self._archivo.tell()
+        self._ultimo_indice = -PASO_INDICE
+        self.segmentos += 1
+
+    def _comprimir_en_segundo_plano(self, ruta):
+        threading.Thread(target=comprimir_segmento, args=(ruta,), daemon=True).start()
+
+
+def comprimir_segmento(ruta):
+    temporal = ruta + '.gz.tmp'
+    try:
+        with open(ruta, 'rb') as origen, gzip.open(temporal, 'wb', compresslevel=6) as destino:
+            shutil.copyfileobj(origen, destino, 1024 * 1024)
+        # Primero aparece el .gz completo y después se borra el original:
+        # un lector siempre encuentra uno de los dos
+        os.replace(temporal, ruta + '.gz')
+        os.remove(ruta)
+    except OSError as e:
+        print(f"[ERROR] Comprimiendo {ruta}: {str(e)}")
+
+
+# ============= LECTURA =============
+def segmentos(directorio):
+    # [(inicio en segundos, ruta base sin extensión)] en orden cronológico
+    bases = set()
+    for nombre in os.listdir(directorio):
+        base, extension = nombre.split('.', 1)
+        if extension in ('seg', 'seg.gz'):
+            bases.add(base)
+    return [(int(base) / 1000, os.path.join(directorio, base)) for base in sorted(bases)]
+
+
+def _cargar_indice(base):
+    try:
+        with open(base + '.idx', 'rb') as archivo:
+            datos = archivo.read()
+    except FileNotFoundError:
+        return [], []
+    # Un registro a medio escribir al final se ignora
+    entradas = list(_INDICE.iter_unpack(datos[:len(datos) - len(datos) % _INDICE.size]))
+    return [t for t, _ in entradas], [posicion for _, posicion in entradas]
+
+
+def _abrir_segmento(base):
+    # Segmento sin comprimir: mmap (solo se leen las páginas que se tocan).
+    # Comprimido: gzip se descomprime en streaming al avanzar, sin cargarlo entero.
+    try:
+        archivo = open(base + '.seg', 'rb')
+    except FileNotFoundError:
+        return gzip.open(base + '.seg.gz', 'rb'), None
+    if os.fstat(archivo.fileno()).st_size == 0:
+        archivo.close()
+        return None, None
+    datos = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+    archivo.close()
+    return None, datos
+
+
+def _registros_mmap(datos, posicion, hasta):
+    tamano = len(datos)
+    cabecera = _REGISTRO.size
+    leer = _REGISTRO.unpack_from
+    while posicion + cabecera <= tamano:
+        t, largo = leer(datos, posicion)
+        fin = posicion + cabecera + largo
+        if fin > tamano:
+            break  # registro a medio escribir en el segmento activo
+        if hasta is not None and t > hasta:
+            return
+        yield t, datos[posicion + cabecera:fin]
+        posicion = fin
+
+
+def _registros_archivo(archivo, posicion, hasta):
+    archivo.seek(posicion)
+    cabecera = _REGISTRO.size
+    while True:
+        encabezado = archivo.read(cabecera)
+        if len(encabezado) < cabecera:
+            return
+        t, largo = _REGISTRO.unpack(encabezado)
+        trama = archivo.read(largo)
+        if len(trama) < largo or (hasta is not None and t > hasta):
+            return
+        yield t, trama
+
+
+def leer_tramas(directorio, desde=None, hasta=None):
+    # Genera (t epoch, trama) entre desde y hasta, saltando con el índice
+    # directo a la zona pedida de cada segmento
+    lista = segmentos(directorio)
+    for i, (inicio, base) in enumerate(lista):
+        siguiente = lista[i + 1][0] if i + 1 < len(lista) else None
+        # Un rango que empieza justo en el inicio del siguiente no necesita este
+        # segmento: abrir un .seg.gz para saltar a su final lo descomprime entero
+        if desde is not None and siguiente is not None and siguiente <= desde:
+            continue
+        if hasta is not None and inicio > hasta:
+            return
+
+        posicion = 0
+        if desde is not None:
+            tiempos, posiciones = _cargar_indice(base)
+            # Última entrada con t < desde: todo lo anterior es más viejo
+            j = bisect_left(tiempos, desde) - 1
+            if j >= 0:
+                posicion = posiciones[j]
+
+        try:
+            comprimido, datos = _abrir_segmento(base)
+        except FileNotFoundError:
+            continue  # se comprimió y borró justo entre listar y abrir
+        if datos is not None:
+            registros = _registros_mmap(datos, posicion, hasta)
+        elif comprimido is not None:
+            registros = _registros_archivo(comprimido, posicion, hasta)
+        else:
+            continue
+        try:
+            for t, trama in registros:
+                if desde is None or t >= desde:
+                    yield t, trama
+        finally:
+            if datos is not None:
+                datos.close()
+            else:
+                comprimido.close()
+
+
+def captura(directorio, desde=None, hasta=None):
+    # La bitácora como captura del simulador: [(segundos desde la primera, bytes)]
+    tramas = []
+    primero = None
+    for t, trama in leer_tramas(directorio, desde, hasta):
+        if primero is None:
+            primero = t
+        trama = bytes(trama)
+        if trama[0] != 0xA5:
+            trama += b'\r\n'  # el separador quita el fin de línea
+        tramas.append((t - primero, trama))
+    return tramas
+
+
+# ============= LÍNEA DE COMANDOS =============
+def fecha(valor):
+    try:
+        return float(valor)
+    except ValueError:
+        return time.mktime(time.strptime(valor, "%Y-%m-%dT%H:%M:%S"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extraer tramas crudas de la bitácora")
+    parser.add_argument('directorio', help="directorio de la línea, p. ej. tramas/linea1")
+    parser.add_argument('--desde', type=fecha, help="epoch o AAAA-MM-DDTHH:MM:SS")
+    parser.add_argument('--hasta', type=fecha)
+    parser.add_argument('--salida', help="captura para 'simulador.py reproducir' (por defecto, pantalla)")
+    args = parser.parse_args()
+
+    total = 0
+    salida = open(args.salida, 'w', encoding='utf-8') if args.salida else None
+    primero = None
+    for t, trama in leer_tramas(args.directorio, args.desde, args.hasta):
+        trama = bytes(trama)
+        if salida is None:
+            marca = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) + f".{int(t % 1 * 1000):03d}"
+            print(f"{marca}  {trama.hex() if trama[0] == 0xA5 else trama.decode('utf-8', errors='replace')}")
+        else:
+            # Mismo formato que simulador.grabar_captura
+            if primero is None:
+                primero = t
+            if trama[0] == 0xA5:
+                salida.write(f"{t - primero:.6f}\tb\t{trama.hex()}\n")
+            else:
+                salida.write(f"{t - primero:.6f}\tt\t{trama.decode('utf-8', errors='replace')}\n")
+        total += 1
+    if salida is not None:
+        salida.close()
+        print(f"💾 {total} tramas guardadas en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import json
+import queue
+import threading
+import time
+
+# ============= DIFUSIÓN DE CAMBIOS AL PANEL =============
+# Un solo hilo revisa cada PERIODO_DIFUSION_S la instantánea de cada línea y,
+# solo si algo cambió, arma el mensaje una vez y lo deja en la cola de cada
+# suscriptor como (tipo, JSON ya serializado, dict). El dict es compartido:
+# /stream y /ws solo lo leen. Los lectores de tramas no se enteran: no hay
+# avisos por trama, el costo es fijo por período y no crece con los clientes.
+# Tipos de mensaje:
+#   datos     sensores de la línea (mismo formato que /datos), al cambiar un valor
+#   conexion  estado de conexión (mismo formato que /estado-conexion), al cambiar status/puerto/baudios
+#   reporte   contador de vasos y eventos nuevos desde el último mensaje
+#   banda     estado de la banda (on/off), al cambiar
+PERIODO_DIFUSION_S = 0.05  # un período de trama del Arduino (20 Hz)
+MENSAJES_POR_SUSCRIPTOR = 256  # un cliente que no lee se desconecta y se reconecta desde cero
+MENSAJES_INICIALES = 4  # estado completo de cada línea al suscribirse (datos, conexión, banda, reporte)
+
+
+class Suscripcion:
+    def __init__(self, lineas):
+        self.lineas = set(lineas)
+        # Lugar para el estado inicial de todas sus líneas además del margen normal
+        self.cola = queue.Queue(MENSAJES_INICIALES * len(self.lineas) + MENSAJES_POR_SUSCRIPTOR)
+        self.atrasada = False
+
+    def responder(self, tipo, datos):
+        # Mensajes solo para este suscriptor (confirmaciones de comandos de /ws)
+        try:
+            self.cola.put_nowait(_mensaje(tipo, datos))
+        except queue.Full:
+            self.atrasada = True
+
+    def siguiente(self, espera):
+        # (tipo, json, dict) o None si no hubo nada en `espera` segundos
+        try:
+            return self.cola.get(timeout=espera)
+        except queue.Empty:
+            return None
+
+
+def _json(datos):
+    return json.dumps(datos, ensure_ascii=False, separators=(',', ':'))
+
+
+def _mensaje(tipo, datos):
+    return tipo, _json(datos), datos
+
+
+class DifusorEstado:
+    def __init__(self, lineas, periodo=PERIODO_DIFUSION_S):
+        self.lineas = lineas  # {id de línea: LineaLlenado}
+        self.periodo = periodo
+        self._suscripciones = []
+        self._lock = threading.Lock()
+        self._ultimos = {}  # id de línea -> (sensores, conexión, banda, id del último evento)
+        self.enviados = 0
+
+    def iniciar(self):
+        threading.Thread(target=self._difundir_periodicamente, daemon=True).start()
+
+    def suscribir(self, lineas):
+        suscripcion = Suscripcion(lineas)
+        # Lo primero que recibe es el estado completo de sus líneas. Con el lock
+        # tomado no puede pasar una vuelta de difundir() entre esa foto y el alta:
+        # ningún cambio queda sin enviar (a lo sumo llega uno repetido). La cola
+        # tiene lugar para todo esto: put_nowait nunca bloquea con el lock tomado
+        with self._lock:
+            for id_linea in suscripcion.lineas:
+                linea = self.lineas[id_linea]
+                estado = linea.estado
+                # Si la línea todavía no tenía foto, esta es la base de la próxima comparación
+                self._ultimos.setdefault(id_linea, self._foto(linea, estado))
+                suscripcion.cola.put_nowait(_mensaje('datos', self._datos(linea)))
+                suscripcion.cola.put_nowait(_mensaje('conexion', linea.estado_conexion()))
+                suscripcion.cola.put_nowait(_mensaje('banda', {"linea": id_linea, "state": linea.led_state}))
+                suscripcion.cola.put_nowait(_mensaje('reporte', {
+                    "linea": id_linea, "vasos": estado.vasos, "completo": True,
+                    "eventos": [evento.como_dict() for evento in estado.eventos]
+                }))
+            self._suscripciones.append(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            if suscripcion in self._suscripciones:
+                self._suscripciones.remove(suscripcion)
+
+    def _foto(self, linea, estado):
+        return ((estado.ir, estado.ultra, estado.temp, estado.bomba),
+                (linea.connection_status, linea.puerto, linea.baudios),
+                linea.led_state,
+                estado.eventos[-1].id if estado.eventos else None)
+
+    def _datos(self, linea):
+        datos = linea.datos_sensores()
+        datos["linea"] = linea.id
+        return datos
+
+    def _difundir_periodicamente(self):
+        while True:
+            time.sleep(self.periodo)
+            try:
+                self.difundir()
+            except Exception as e:
+                print(f"[ERROR] Difundiendo estado: {str(e)}")
+
+    def difundir(self):
+        with self._lock:
+            self._difundir(self._suscripciones)
+
+    def _difundir(self, suscripciones):
+        for id_linea, linea in self.lineas.items():
+            estado = linea.estado
+            foto = self._foto(linea, estado)
+            sensores, conexion, banda, ultimo_evento = foto
+            anterior = self._ultimos.get(id_linea)
+            self._ultimos[id_linea] = foto
+            if anterior is None:
+                continue  # nadie suscrito todavía: los nuevos reciben el estado completo
+            interesados = [suscripcion for suscripcion in suscripciones if id_linea in suscripcion.lineas]
+            if not interesados:
+                continue
+
+            mensajes = []
+            if sensores != anterior[0]:
+                mensajes.append(_mensaje('datos', self._datos(linea)))
+            if conexion != anterior[1]:
+                mensajes.append(_mensaje('conexion', linea.estado_conexion()))
+            if banda != anterior[2]:
+                mensajes.append(_mensaje('banda', {"linea": id_linea, "state": banda}))
+            if ultimo_evento != anterior[3]:
+                nuevos = [evento.como_dict() for evento in estado.eventos
+                          if anterior[3] is None or evento.id > anterior[3]]
+                mensajes.append(_mensaje('reporte', {"linea": id_linea, "vasos": estado.vasos,
+                                                     "completo": False, "eventos": nuevos}))
+            for suscripcion in interesados:
+                for mensaje in mensajes:
+                    try:
+                        suscripcion.cola.put_nowait(mensaje)
+                    except queue.Full:
+                        suscripcion.atrasada = True
+                        break
+            self.enviados += len(mensajes) * len(interesados)
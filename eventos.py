@@ -0,0 +1,222 @@
+import itertools
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from enum import IntEnum
+
+from formato import texto_fecha, texto_nivel, texto_temp
+
+# ============= EVENTO DE LLENADO =============
+# Registro compacto: una tupla con números y un código. Los textos de pantalla
+# ("Llenado completado", "12.3 cm", la fecha) se arman solo al mostrarlo.
+class TipoEvento(IntEnum):
+    COLOCADO = 1            # flanco de IR: vaso colocado
+    LLENADO_COMPLETADO = 2  # flanco de BOMBA: de encendida a apagada
+
+ESTADOS_EVENTO = {
+    TipoEvento.COLOCADO: "Colocado",
+    TipoEvento.LLENADO_COMPLETADO: "Llenado completado",
+}
+
+
+class EventoLlenado(namedtuple('EventoLlenado', ['id', 'linea', 'codigo', 't', 'ultra', 'temp'])):
+    __slots__ = ()
+    tipo = "Vaso"
+
+    @property
+    def estado(self):
+        return ESTADOS_EVENTO[self.codigo]
+
+    @property
+    def timestamp(self):
+        return texto_fecha(self.t)
+
+    @property
+    def nivel(self):
+        return texto_nivel(self.ultra)
+
+    @property
+    def temperatura(self):
+        return texto_temp(self.temp)
+
+    def como_dict(self):
+        # Formato de /reporte-llenados (el mismo que usa el panel)
+        return {
+            'id': self.id,
+            'linea': self.linea,
+            'tipo': self.tipo,
+            'codigo': int(self.codigo),
+            'estado': self.estado,
+            't': self.t,
+            'timestamp': self.timestamp,
+            'nivel': self.nivel,
+            'temp': self.temperatura
+        }
+
+    @classmethod
+    def desde_fila(cls, fila):
+        return cls(fila[0], fila[1], TipoEvento(fila[2]), fila[3], fila[4], fila[5])
+
+# ============= ALMACÉN DE EVENTOS (SQLITE) =============
+# Los eventos de llenado se guardan en SQLite en modo WAL para que sobrevivan a
+# un reinicio. Quien procesa tramas solo deja el evento en una lista en memoria;
+# un hilo escritor los inserta por lotes (cada INTERVALO_ESCRITURA_S o en cuanto
+# se juntan LOTE_ESCRITURA), así la lectura serial nunca espera al disco.
+# Las consultas abren su propia conexión por hilo: con WAL leen sin bloquear al escritor.
+# Si SQLite falla (disco lleno, base bloqueada) el lote vuelve al principio de
+# la cola y se reintenta cada INTERVALO_ESCRITURA_S; recién tras
+# REINTENTOS_ESCRITURA fallas seguidas se descarta, y queda contado.
+INTERVALO_ESCRITURA_S = 0.5
+LOTE_ESCRITURA = 200
+REINTENTOS_ESCRITURA = 10
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS eventos (
+    id INTEGER PRIMARY KEY,
+    linea TEXT NOT NULL,
+    codigo INTEGER NOT NULL,
+    t REAL NOT NULL,
+    ultra REAL,
+    temp REAL
+);
+CREATE INDEX IF NOT EXISTS eventos_t ON eventos (t);
+CREATE INDEX IF NOT EXISTS eventos_codigo ON eventos (linea, codigo);
+"""
+
+
+class AlmacenEventos:
+    def __init__(self, ruta, intervalo=INTERVALO_ESCRITURA_S, lote=LOTE_ESCRITURA):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.lote = lote
+        self._pendientes = []
+        self._condicion = threading.Condition()
+        self._detenido = False
+        self._local = threading.local()
+
+        self.escritos = 0
+        self.lotes = 0
+        self.errores = 0
+        self.descartados = 0
+        self._fallos = 0  # fallas seguidas del lote actual
+
+        conexion = sqlite3.connect(ruta)
+        # Bases nuevas: el espacio de eventos borrados por retención (retencion.py)
+        # se devuelve de a poco con incremental_vacuum
+        conexion.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.executescript(ESQUEMA)
+        ultimo_id = conexion.execute("SELECT MAX(id) FROM eventos").fetchone()[0]
+        conexion.close()
+        # Los ids se asignan al crear el evento, así la caché y la base coinciden
+        self._ids = itertools.count((ultimo_id or 0) + 1)
+
+        self._hilo = threading.Thread(target=self._escribir, daemon=True)
+        self._hilo.start()
+
+    def nuevo_id(self):
+        return next(self._ids)
+
+    def agregar(self, evento):
+        with self._condicion:
+            self._pendientes.append(evento)
+            if len(self._pendientes) >= self.lote:
+                self._condicion.notify()
+
+    def detener(self):
+        # Escribe lo pendiente y termina el hilo escritor
+        with self._condicion:
+            self._detenido = True
+            self._condicion.notify()
+        self._hilo.join()
+
+    def _escribir(self):
+        conexion = sqlite3.connect(self.ruta)
+        conexion.execute("PRAGMA synchronous=NORMAL")
+        while True:
+            with self._condicion:
+                self._condicion.wait_for(lambda: len(self._pendientes) >= self.lote or self._detenido,
+                                         self.intervalo)
+                lote, self._pendientes = self._pendientes, []
+                detenido = self._detenido
+            if lote:
+                try:
+                    with conexion:
+                        # EventoLlenado ya es la fila: (id, linea, codigo, t, ultra, temp)
+                        conexion.executemany("INSERT OR REPLACE INTO eventos VALUES (?, ?, ?, ?, ?, ?)", lote)
+                    self.escritos += len(lote)
+                    self.lotes += 1
+                    self._fallos = 0
+                except sqlite3.Error as e:
+                    self.errores += 1
+                    self._fallos += 1
+                    if self._fallos < REINTENTOS_ESCRITURA:
+                        print(f"[ERROR] Guardando {len(lote)} eventos en {self.ruta} "
+                              f"(intento {self._fallos}/{REINTENTOS_ESCRITURA}): {str(e)}")
+                        # Vuelven adelante para no desordenar los ids; los nuevos siguen detrás
+                        with self._condicion:
+                            self._pendientes[:0] = lote
+                        time.sleep(self.intervalo)
+                        continue
+                    print(f"[ERROR] Se descartan {len(lote)} eventos tras {self._fallos} intentos: {str(e)}")
+                    self.descartados += len(lote)
+                    self._fallos = 0
+            if detenido:
+                conexion.close()
+                return
+
+    # ---------- Consultas ----------
+    def _conexion(self):
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta)
+            conexion.row_factory = lambda cursor, fila: EventoLlenado.desde_fila(fila)
+            self._local.conexion = conexion
+        return conexion
+
+    def consultar(self, lineas=None, desde=None, hasta=None, limite=None):
+        condiciones = []
+        parametros = []
+        if lineas is not None:
+            condiciones.append(f"linea IN ({', '.join('?' * len(lineas))})")
+            parametros += lineas
+        if desde is not None:
+            condiciones.append("t >= ?")
+            parametros.append(desde)
+        if hasta is not None:
+            condiciones.append("t <= ?")
+            parametros.append(hasta)
+        sql = "SELECT * FROM eventos"
+        if condiciones:
+            sql += " WHERE " + " AND ".join(condiciones)
+        sql += " ORDER BY t, id"
+        if limite is not None:
+            sql += " LIMIT ?"
+            parametros.append(limite)
+        return self._conexion().execute(sql, parametros).fetchall()
+
+    def anteriores(self, lineas, antes_de, limite):
+        # Página hacia atrás por id: los `limite` eventos anteriores a `antes_de`, en orden
+        filas = self._conexion().execute(
+            f"SELECT * FROM eventos WHERE id < ? AND linea IN ({', '.join('?' * len(lineas))}) "
+            "ORDER BY id DESC LIMIT ?", [antes_de, *lineas, limite])
+        return filas.fetchall()[::-1]
+
+    def recientes(self, linea, cantidad):
+        filas = self._conexion().execute(
+            "SELECT * FROM eventos WHERE linea = ? ORDER BY id DESC LIMIT ?", (linea, cantidad))
+        return filas.fetchall()[::-1]
+
+    def contar(self, linea, codigo, despues_de=0):
+        # Eventos de ese tipo con id mayor a `despues_de` (por defecto, todos)
+        cursor = self._conexion().cursor()
+        cursor.row_factory = None  # filas sueltas, no eventos
+        return cursor.execute("SELECT COUNT(*) FROM eventos WHERE id > ? AND linea = ? AND codigo = ?",
+                              (despues_de, linea, int(codigo))).fetchone()[0]
+
+    def estadisticas(self):
+        with self._condicion:
+            pendientes = len(self._pendientes)
+        return {"pendientes": pendientes, "escritos": self.escritos, "lotes": self.lotes,
+                "errores": self.errores, "descartados": self.descartados}
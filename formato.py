@@ -0,0 +1,21 @@
+import time
+
+# ============= FORMATO PARA MOSTRAR =============
+# El estado y los eventos guardan números; el texto solo se arma cuando un
+# cliente lo pide (panel, reportes, CSV, PDF)
+SIN_DATOS = "Esperando datos..."
+
+def texto_ir(ir):
+    return "Vaso detectado" if ir == 0 else "Sin vaso"
+
+def texto_nivel(ultra):
+    return f"{ultra:g} cm"
+
+def texto_temp(temp):
+    return f"{temp:.1f} °C" if temp is not None else "Error"
+
+def texto_bomba(bomba):
+    return "Encendida" if bomba else "Apagada"
+
+def texto_fecha(t):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
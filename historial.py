@@ -0,0 +1,226 @@
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+# ============= SERIE CIRCULAR =============
+# Tiempos (epoch, s) y una o más columnas de valores, cada una en un array('d')
+# de tamaño fijo reservado de una vez (8 bytes por columna y muestra).
+# agregar() es O(1) y pisa la muestra más vieja cuando se llena. Un solo hilo
+# escribe; las consultas no toman locks: el contador `total` se incrementa
+# después de escribir la muestra, y si el escritor pisó parte de lo copiado
+# durante la consulta, esas muestras se recortan.
+# Hay una casilla de más para la muestra que se está escribiendo en cada momento.
+class SerieCircular:
+    def __init__(self, capacidad, columnas=('v',)):
+        self.capacidad = capacidad
+        self.columnas = columnas
+        self._casillas = capacidad + 1
+        self.tiempos = array('d', bytes(8 * self._casillas))
+        self.datos = [array('d', bytes(8 * self._casillas)) for _ in columnas]
+        self.total = 0  # muestras agregadas desde el inicio
+
+    def agregar(self, t, *valores):
+        i = self.total % self._casillas
+        self.tiempos[i] = t
+        for columna, valor in zip(self.datos, valores):
+            columna[i] = valor
+        self.total += 1
+
+    def primero(self):
+        # Tiempo de la muestra más vieja que se conserva (None si está vacía)
+        total = self.total
+        if not total:
+            return None
+        return self.tiempos[max(0, total - self.capacidad) % self._casillas]
+
+    def consultar(self, desde=None, hasta=None, puntos=None):
+        # Devuelve (tiempos, [una array('d') por columna])
+        capacidad = self.capacidad
+        casillas = self._casillas
+        total = self.total
+        primera = max(0, total - capacidad)
+        inicio = primera % casillas
+        final = inicio + total - primera
+
+        # Tramos físicos en orden cronológico, con el índice lógico de su primera muestra
+        if final <= casillas:
+            tramos = [(inicio, final, primera)]
+        else:
+            tramos = [(inicio, casillas, primera), (0, final - casillas, primera + casillas - inicio)]
+
+        # Búsqueda binaria de [desde, hasta] dentro de cada tramo (cada uno está ordenado)
+        cortes = []
+        for inicio, final, logico in tramos:
+            a = inicio if desde is None else bisect_left(self.tiempos, desde, inicio, final)
+            b = final if hasta is None else bisect_right(self.tiempos, hasta, inicio, final)
+            if a < b:
+                cortes.append((a, b, logico + a - inicio))
+        cantidad = sum(b - a for a, b, _ in cortes)
+        tiempos = array('d')
+        datos = [array('d') for _ in self.columnas]
+        if not cantidad:
+            return tiempos, datos
+
+        # Con muchos puntos se toma uno de cada `paso`, con slices de paso fijo
+        paso = 1 if not puntos or cantidad <= puntos else -(-cantidad // puntos)
+        saltar = 0
+        for a, b, _ in cortes:
+            tiempos += self.tiempos[a + saltar:b:paso]
+            for destino, columna in zip(datos, self.datos):
+                destino += columna[a + saltar:b:paso]
+            # Mantener el paso uniforme al cruzar el borde del buffer
+            saltar = (saltar - (b - a)) % paso
+
+        # Muestras pisadas por el escritor mientras se copiaba
+        pisadas = self.total - capacidad - cortes[0][2]
+        if pisadas > 0:
+            recorte = -(-pisadas // paso)
+            del tiempos[:recorte]
+            for destino in datos:
+                del destino[:recorte]
+        return tiempos, datos
+
+    def memoria(self):
+        return self.tiempos.itemsize * len(self.tiempos) * (1 + len(self.datos))
+
+
+# ============= RESÚMENES POR RESOLUCIÓN =============
+# Mínimo, máximo, media, cantidad y último valor por intervalo fijo (1 s, 1 min,
+# 1 h...). Cada nivel acumula el intervalo en curso en variables sueltas; al
+# cambiar de intervalo lo guarda en su serie y se lo pasa ya resumido al nivel
+# siguiente. Así cada trama solo toca el primer nivel: O(1) sin importar cuántos
+# niveles haya. El intervalo en curso no aparece en las consultas hasta cerrarse.
+COLUMNAS_RESUMEN = ('min', 'max', 'media', 'n', 'ultimo')
+
+
+class NivelResumen:
+    def __init__(self, resolucion, capacidad, siguiente=None):
+        self.resolucion = resolucion
+        self.serie = SerieCircular(capacidad, COLUMNAS_RESUMEN)
+        self.siguiente = siguiente
+        self._inicio = None
+        self._minimo = self._maximo = self._suma = self._ultimo = 0.0
+        self._cuenta = 0
+
+    def agregar(self, t, minimo, maximo, suma, cuenta, ultimo):
+        inicio = t - t % self.resolucion
+        if inicio != self._inicio:
+            self.cerrar()
+            self._inicio = inicio
+            self._minimo = minimo
+            self._maximo = maximo
+            self._suma = suma
+            self._cuenta = cuenta
+        else:
+            if minimo < self._minimo:
+                self._minimo = minimo
+            if maximo > self._maximo:
+                self._maximo = maximo
+            self._suma += suma
+            self._cuenta += cuenta
+        self._ultimo = ultimo
+
+    def cerrar(self):
+        if not self._cuenta:
+            return
+        self.serie.agregar(self._inicio, self._minimo, self._maximo, self._suma / self._cuenta,
+                           self._cuenta, self._ultimo)
+        if self.siguiente is not None:
+            self.siguiente.agregar(self._inicio, self._minimo, self._maximo, self._suma,
+                                   self._cuenta, self._ultimo)
+        self._cuenta = 0
+
+
+# ============= HISTORIAL DE UNA LÍNEA =============
+# Por sensor: una serie de muestras crudas y una cadena de niveles de resumen.
+# Para que la serie cruda equivalga siempre a la misma ventana de tiempo, se
+# guarda como máximo una muestra cada `intervalo` segundos aunque el Arduino
+# envíe más rápido; los resúmenes, en cambio, reciben todas las tramas.
+SENSORES_HISTORIAL = ('ULTRA', 'TEMP')
+
+# (resolución en segundos, intervalos que se conservan)
+NIVELES_RESUMEN = (
+    (1, 24 * 3600),         # 1 s durante 24 h
+    (60, 30 * 24 * 60),     # 1 min durante 30 días
+    (3600, 365 * 24),       # 1 h durante un año
+)
+
+
+class HistorialSensores:
+    def __init__(self, capacidad, intervalo, niveles=NIVELES_RESUMEN):
+        self.intervalo = intervalo
+        self.series = {sensor: SerieCircular(capacidad) for sensor in SENSORES_HISTORIAL}
+        self.niveles = {}
+        for sensor in SENSORES_HISTORIAL:
+            # Se arma de la más gruesa a la más fina para enlazar cada una con la siguiente
+            cadena = []
+            siguiente = None
+            for resolucion, capacidad_nivel in reversed(niveles):
+                siguiente = NivelResumen(resolucion, capacidad_nivel, siguiente)
+                cadena.insert(0, siguiente)
+            self.niveles[sensor] = cadena
+
+        self._ultra = self.series['ULTRA']
+        self._temp = self.series['TEMP']
+        self._resumen_ultra = self.niveles['ULTRA'][0].agregar
+        self._resumen_temp = self.niveles['TEMP'][0].agregar
+        self._ultimo = float('-inf')
+        # Los tiempos se guardan en epoch para poder consultar por fecha;
+        # se derivan de time.monotonic() para que nunca retrocedan
+        self._desfase = time.time() - time.monotonic()
+        self.inicio = time.time()
+
+    def agregar(self, recibido, ultra, temp):
+        t = recibido + self._desfase
+        self._resumen_ultra(t, ultra, ultra, ultra, 1, ultra)
+        if temp is not None:
+            # Sin lectura de temperatura: queda un hueco en la serie
+            self._resumen_temp(t, temp, temp, temp, 1, temp)
+
+        if recibido - self._ultimo < self.intervalo:
+            return
+        self._ultimo = recibido
+        self._ultra.agregar(t, ultra)
+        if temp is not None:
+            self._temp.agregar(t, temp)
+
+    def consultar(self, sensor, desde=None, hasta=None, puntos=2000):
+        # Usa la serie más fina que entregue como mucho `puntos` puntos para el
+        # rango pedido y que todavía conserve datos desde `desde`. Si ninguna
+        # alcanza, se diezma la más gruesa que tenga datos.
+        fin = time.time() if hasta is None else hasta
+        candidatos = [(self.intervalo, self.series[sensor])]
+        candidatos += [(nivel.resolucion, nivel.serie) for nivel in self.niveles[sensor]]
+
+        resolucion, serie = candidatos[0]
+        for candidato in candidatos:
+            primero = candidato[1].primero()
+            if primero is None:
+                continue
+            resolucion, serie = candidato
+            inicio = primero if desde is None else desde
+            # Una serie que nunca se llenó tiene todo lo que vio desde el arranque
+            completa = serie.total <= serie.capacidad or primero <= inicio
+            if completa and (fin - inicio) / resolucion <= puntos:
+                break
+
+        tiempos, datos = serie.consultar(desde, hasta, puntos)
+        respuesta = {"resolucion": resolucion, "t": tiempos.tolist()}
+        if serie.columnas == COLUMNAS_RESUMEN:
+            respuesta.update((columna, valores.tolist()) for columna, valores in zip(serie.columnas, datos))
+            respuesta["v"] = respuesta["media"]
+        else:
+            respuesta["v"] = datos[0].tolist()
+        return respuesta
+
+    def cobertura(self):
+        # Instante desde el que la memoria tiene todo: el arranque, o lo más
+        # viejo que conserva el resumen más grueso si ya dio la vuelta
+        serie = self.niveles[SENSORES_HISTORIAL[0]][-1].serie
+        if serie.total <= serie.capacidad:
+            return self.inicio
+        return max(self.inicio, serie.primero())
+
+    def memoria(self):
+        crudas = sum(serie.memoria() for serie in self.series.values())
+        return crudas + sum(nivel.serie.memoria() for cadena in self.niveles.values() for nivel in cadena)
@@ -0,0 +1,182 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from tramas import SeparadorTramas
+
+# ============= COLA ACOTADA ENTRE LECTURA Y PROCESAMIENTO =============
+# El hilo lector solo separa tramas y las deja aquí; el hilo de procesamiento
+# las consume por lotes. Si el procesamiento se atrasa, la política decide qué
+# pasa cuando la cola está llena:
+#   descartar_antiguas: se pierde la trama más vieja (el lector nunca espera)
+#   bloquear:           el lector espera a que haya espacio
+#   fusionar:           la trama nueva reemplaza a la última encolada
+POLITICAS = ('descartar_antiguas', 'bloquear', 'fusionar')
+
+
+class ColaTramas:
+    def __init__(self, capacidad=4096, politica='descartar_antiguas'):
+        if politica not in POLITICAS:
+            raise ValueError(f"Política desconocida: {politica}")
+        self.capacidad = capacidad
+        self.politica = politica
+        self._tramas = deque()
+        self._condicion = threading.Condition()
+
+        self.recibidas = 0
+        self.descartadas = 0
+        self.fusionadas = 0
+        self.bloqueos = 0
+        self.profundidad_maxima = 0
+
+    def poner_lote(self, tramas):
+        if not tramas:
+            return
+        with self._condicion:
+            cola = self._tramas
+            for trama in tramas:
+                if len(cola) >= self.capacidad:
+                    if self.politica == 'descartar_antiguas':
+                        cola.popleft()
+                        self.descartadas += 1
+                    elif self.politica == 'fusionar':
+                        cola[-1] = trama
+                        self.fusionadas += 1
+                        continue
+                    else:
+                        self.bloqueos += 1
+                        self._condicion.notify_all()
+                        while len(cola) >= self.capacidad:
+                            self._condicion.wait()
+                cola.append(trama)
+            self.recibidas += len(tramas)
+            if len(cola) > self.profundidad_maxima:
+                self.profundidad_maxima = len(cola)
+            self._condicion.notify_all()
+
+    def tomar_lote(self, timeout=None):
+        with self._condicion:
+            if not self._tramas and not self._condicion.wait(timeout):
+                return []
+            lote = list(self._tramas)
+            self._tramas.clear()
+            # Despertar al lector si estaba bloqueado por la cola llena
+            self._condicion.notify_all()
+            return lote
+
+    def estadisticas(self):
+        return {
+            "profundidad": len(self._tramas),
+            "capacidad": self.capacidad,
+            "politica": self.politica,
+            "recibidas": self.recibidas,
+            "descartadas": self.descartadas,
+            "fusionadas": self.fusionadas,
+            "bloqueos": self.bloqueos,
+            "profundidad_maxima": self.profundidad_maxima
+        }
+
+
+# ============= MOTOR DE INGESTA ASÍNCRONO (LINUX) =============
+# Un solo bucle asyncio atiende todos los puertos: cada descriptor se registra
+# con add_reader() y el callback lee, separa y procesa lo que haya llegado.
+# Abrir el puerto y detectar la velocidad bloquea unos segundos (reinicio del
+# Arduino), así que solo ese paso se delega al ejecutor por defecto.
+REINTENTO_S = 3
+TAMANO_LECTURA = 65536
+
+
+class DispositivoSerial:
+    def __init__(self, nombre, abrir, procesar, al_error=None, al_desconectar=None, separador=None,
+                 registrar=None):
+        self.nombre = nombre
+        self.abrir = abrir                  # () -> serial.Serial ya configurado
+        self.procesar = procesar            # (trama en bytes, time.monotonic() al recibirla) -> None
+        self.al_error = al_error            # (excepción) -> None
+        self.al_desconectar = al_desconectar
+        self.separador = separador if separador is not None else SeparadorTramas()
+        self.registrar = registrar          # (time.monotonic(), [tramas de una lectura]) -> None
+
+
+class MotorIngesta:
+    def __init__(self, dispositivos=()):
+        self.dispositivos = list(dispositivos)
+        self.loop = None
+        self._tareas = []
+
+    async def correr(self):
+        # Se puede esperar desde un servidor asíncrono que ya tenga su propio bucle
+        self.loop = asyncio.get_running_loop()
+        self._tareas = [
+            asyncio.create_task(self._mantener(dispositivo), name=dispositivo.nombre)
+            for dispositivo in self.dispositivos
+        ]
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+
+    def ejecutar(self):
+        # Para correr el motor en un hilo junto al servidor Flask
+        asyncio.run(self.correr())
+
+    def detener(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(lambda: [tarea.cancel() for tarea in self._tareas])
+
+    async def _mantener(self, dispositivo):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                conexion = await loop.run_in_executor(None, dispositivo.abrir)
+            except Exception as e:
+                if dispositivo.al_error is not None:
+                    dispositivo.al_error(e)
+                await asyncio.sleep(REINTENTO_S)
+                continue
+            
+            await self._leer(dispositivo, conexion)
+            if dispositivo.al_desconectar is not None:
+                dispositivo.al_desconectar()
+            await asyncio.sleep(REINTENTO_S)
+
+    async def _leer(self, dispositivo, conexion):
+        loop = asyncio.get_running_loop()
+        fd = conexion.fileno()
+        cerrado = loop.create_future()
+        separador = dispositivo.separador
+        procesar = dispositivo.procesar
+        registrar = dispositivo.registrar
+        separador.reiniciar()
+        
+        def al_leer():
+            # pyserial abre el puerto con O_NONBLOCK: leer nunca bloquea el bucle
+            try:
+                datos = os.read(fd, TAMANO_LECTURA)
+            except BlockingIOError:
+                return
+            except OSError:
+                datos = b''
+            if not datos:
+                # EOF / EIO: el dispositivo se desconectó
+                if not cerrado.done():
+                    cerrado.set_result(None)
+                return
+            recibido = time.monotonic()
+            tramas = separador.alimentar(datos)
+            if registrar is not None:
+                registrar(recibido, tramas)
+            for linea in tramas:
+                try:
+                    procesar(linea, recibido)
+                except Exception as e:
+                    print(f"[ERROR] Procesando trama {linea!r} de {dispositivo.nombre}: {str(e)}")
+        
+        loop.add_reader(fd, al_leer)
+        try:
+            await cerrado
+        finally:
+            loop.remove_reader(fd)
+            try:
+                conexion.close()
+            except Exception:
+                pass
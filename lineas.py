@@ -0,0 +1,443 @@
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+import serial
+
+from eventos import EventoLlenado, TipoEvento
+from formato import SIN_DATOS, texto_bomba, texto_ir, texto_nivel, texto_temp
+from historial import HistorialSensores
+from ingesta import ColaTramas, DispositivoSerial
+from tramas import SeparadorTramas, parsear_linea
+
+# ============= CONFIGURACIÓN DEL ENLACE SERIAL =============
+BAUD_RATE = 9600  # Velocidad por defecto si no se detecta ninguna
+
+# Velocidades a probar, en orden; la detectada se recuerda por puerto
+BAUDIOS_CANDIDATOS = [115200, 230400, 500000, 9600]
+PRUEBA_BAUDIOS_S = 1.5       # Tiempo máximo escuchando cada velocidad
+TRAMAS_PARA_DETECTAR = 2     # Tramas válidas necesarias para aceptarla
+ARCHIVO_BAUDIOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baudios.json')
+EVENTOS_RECIENTES = 100      # eventos por línea en la caché (instantánea)
+
+# ============= DETECCIÓN DE PUERTOS DISPONIBLES =============
+puertos_disponibles = []
+
+def detectar_puertos():
+    puertos_disponibles.clear()
+
+    if os.name == 'nt':
+        for i in range(1, 20):
+            port_name = f'COM{i}'
+            try:
+                s = serial.Serial(port_name)
+                s.close()
+                puertos_disponibles.append(port_name)
+            except (OSError, serial.SerialException):
+                pass
+    else:
+        for port in ['/dev/ttyACM0', '/dev/ttyACM1', '/dev/ttyUSB0', '/dev/ttyUSB1']:
+            if os.path.exists(port):
+                puertos_disponibles.append(port)
+
+    return puertos_disponibles
+
+# ============= DETECCIÓN DE VELOCIDAD (BAUDIOS) =============
+def cargar_baudios_recordados():
+    try:
+        with open(ARCHIVO_BAUDIOS, encoding='utf-8') as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError):
+        return {}
+
+baudios_recordados = cargar_baudios_recordados()
+_bloqueo_baudios = threading.Lock()
+
+def recordar_baudios(puerto, baudios):
+    with _bloqueo_baudios:
+        if baudios_recordados.get(puerto) == baudios:
+            return
+        baudios_recordados[puerto] = baudios
+        try:
+            with open(ARCHIVO_BAUDIOS, 'w', encoding='utf-8') as archivo:
+                json.dump(baudios_recordados, archivo)
+        except OSError as e:
+            print(f"[WARNING] No se pudo guardar la velocidad detectada: {e}")
+
+def candidatos_baudios(puerto):
+    # La velocidad que funcionó la última vez se prueba primero
+    recordada = baudios_recordados.get(puerto)
+    if recordada is None:
+        return list(BAUDIOS_CANDIDATOS)
+    return [recordada] + [b for b in BAUDIOS_CANDIDATOS if b != recordada]
+
+def detectar_baudios(conexion, candidatos, duracion=PRUEBA_BAUDIOS_S, minimo=TRAMAS_PARA_DETECTAR):
+    # Cambiar baudrate no reabre el puerto, así el Arduino no se reinicia en cada prueba
+    for baudios in candidatos:
+        conexion.baudrate = baudios
+        conexion.reset_input_buffer()
+        separador_prueba = SeparadorTramas()
+        validas = 0
+        limite = time.monotonic() + duracion
+
+        while time.monotonic() < limite:
+            datos = conexion.read(conexion.in_waiting or 1)
+            if not datos:
+                continue
+            for linea in separador_prueba.alimentar(datos):
+                if parsear_linea(linea) is not None:
+                    validas += 1
+            if validas >= minimo:
+                return baudios
+    return None
+
+# ============= INSTANTÁNEA DEL ESTADO =============
+# Cada trama produce una instantánea nueva e inmutable que se publica con una
+# sola asignación (self.estado = ...). Quien la lea se queda con una foto
+# coherente de sensores, contador y eventos, sin locks y sin mezclar tramas.
+Instantanea = namedtuple('Instantanea', [
+    'version',      # tramas aplicadas; 0 = todavía sin datos
+    'valores',      # veces que cambió IR/ULTRA/TEMP/BOMBA (versión de /datos)
+    'ir',           # 0 = vaso detectado
+    'ultra',        # cm
+    'temp',         # °C, None si el sensor no da lectura
+    'bomba',        # True = encendida
+    'recibido',     # time.monotonic() al recibir la trama
+    'vasos',        # llenados completados
+    'eventos'       # tupla con los últimos eventos (la misma mientras no haya flancos)
+])
+
+ESTADO_INICIAL = Instantanea(0, 0, None, None, None, None, None, 0, ())
+
+# ============= LÍNEA DE LLENADO =============
+# Todo el estado de una línea (un Arduino en un puerto): conexión, sensores,
+# contador de vasos y eventos. Cada línea es independiente de las demás.
+class LineaLlenado:
+    def __init__(self, id_linea, puerto, capacidad_cola=4096, politica_cola='descartar_antiguas',
+                 puerto_alternativo=True, muestras_historial=864000, intervalo_historial=0.1,
+                 almacen=None, bitacora=None, respaldo=None):
+        self.id = id_linea
+        self.puerto = puerto
+        # Con varias líneas cada una tiene su puerto fijo: no saltar al de otra
+        self.puerto_alternativo = puerto_alternativo
+
+        self.arduino = None
+        self.baudios = None
+        self.connection_status = "Conectando..."
+        self.led_state = "off"
+        self._comando = threading.Lock()  # un comando de banda por vez en el puerto
+
+        # Última instantánea publicada; solo el hilo que procesa tramas la reemplaza
+        self.estado = ESTADO_INICIAL
+        # Caché de los últimos eventos; el historial completo queda en el almacén (eventos.py)
+        self._eventos = deque(maxlen=EVENTOS_RECIENTES)
+        self.almacen = almacen
+        self.respaldo = respaldo
+        if almacen is not None:
+            self._nuevo_id = almacen.nuevo_id
+            self._eventos.extend(almacen.recientes(id_linea, self._eventos.maxlen))
+        else:
+            self._nuevo_id = itertools.count(1).__next__
+        self._restaurar()
+
+        # Series de ULTRA y TEMP para las tendencias del panel
+        self.historial = HistorialSensores(muestras_historial, intervalo_historial)
+
+        # Tramas crudas en disco (bitacora.BitacoraTramas), con hora de reloj
+        self.bitacora = bitacora
+        self._desfase = time.time() - time.monotonic()
+
+        self.separador = SeparadorTramas()
+        self.cola = ColaTramas(capacidad_cola, politica_cola)
+
+    def _restaurar(self):
+        # Contador y detectores de flancos de la ejecución anterior. El respaldo
+        # puede haber quedado hasta un segundo atrás: los llenados guardados en
+        # el almacén después de su último evento se suman aparte.
+        guardado = self.respaldo.estado_linea(self.id) if self.respaldo is not None else None
+        llenado = TipoEvento.LLENADO_COMPLETADO
+        if guardado is not None:
+            vasos = guardado["vasos"]
+            ir, bomba = guardado["ir"], guardado["bomba"]
+            ultimo_evento = guardado["ultimo_evento"] or 0
+            if self.almacen is not None and self._eventos and self._eventos[-1].id > ultimo_evento:
+                vasos += self.almacen.contar(self.id, llenado, ultimo_evento)
+                # Los detectores del respaldo son anteriores a esos eventos: se toman
+                # del último guardado. Tanto COLOCADO como LLENADO_COMPLETADO dejan
+                # el vaso presente y la bomba apagada; si la bomba seguía encendida,
+                # el flanco de apagado llega con las próximas tramas y se cuenta una sola vez
+                ir, bomba = 0, False
+            self.estado = ESTADO_INICIAL._replace(vasos=vasos, ir=ir, bomba=bomba,
+                                                  eventos=tuple(self._eventos))
+        elif self.almacen is not None:
+            self.estado = ESTADO_INICIAL._replace(vasos=self.almacen.contar(self.id, llenado),
+                                                  eventos=tuple(self._eventos))
+
+    # ---------- Conexión ----------
+    def abrir(self):
+        print(f"🔌 [{self.id}] Intentando conectar a {self.puerto}...")
+        candidatos = candidatos_baudios(self.puerto)
+        conexion = serial.Serial(self.puerto, candidatos[0], timeout=0.1)
+        try:
+            time.sleep(2)  # El Arduino se reinicia al abrir el puerto
+            self.connection_status = "Detectando velocidad..."
+            baudios = detectar_baudios(conexion, candidatos)
+            if baudios is None:
+                # Sin tramas válidas (Arduino en silencio): usar la velocidad por defecto
+                baudios = BAUD_RATE
+                print(f"[⚠️] [{self.id}] No se recibieron tramas válidas, usando {BAUD_RATE} baudios")
+            else:
+                recordar_baudios(self.puerto, baudios)
+            conexion.baudrate = baudios
+            conexion.timeout = 1
+            conexion.flushInput()
+        except Exception:
+            conexion.close()
+            raise
+        self.baudios = baudios
+        self.arduino = conexion
+        self.connection_status = "Conectado"
+        print(f"[✅] [{self.id}] Conexión establecida con Arduino en {self.puerto} a {baudios} baudios")
+        return conexion
+
+    def error_conexion(self, e):
+        if isinstance(e, serial.SerialException):
+            if "PermissionError" in str(e) or "Acceso denegado" in str(e):
+                self.connection_status = f"Error: Acceso denegado a {self.puerto}"
+                print(f"[❌] [{self.id}] Acceso denegado al puerto {self.puerto}. ¿Está abierto en otro programa?")
+
+                if self.puerto_alternativo and puertos_disponibles:
+                    nuevo_puerto = next((p for p in puertos_disponibles if p != self.puerto), None)
+                    if nuevo_puerto:
+                        print(f"🔄 [{self.id}] Intentando con puerto alternativo: {nuevo_puerto}")
+                        self.puerto = nuevo_puerto
+            else:
+                self.connection_status = f"Error: {str(e)}"
+                print(f"[❌] [{self.id}] Error de conexión: {str(e)}")
+
+            if self.arduino and self.arduino.is_open:
+                try:
+                    self.arduino.close()
+                except:
+                    pass
+        else:
+            self.connection_status = f"Error: {str(e)}"
+            print(f"[❌] [{self.id}] Error inesperado: {str(e)}")
+        self.arduino = None
+
+    def desconectado(self):
+        self.connection_status = "Error: Arduino desconectado"
+        print(f"[❌] [{self.id}] Se perdió la conexión con {self.puerto}")
+        self.arduino = None
+
+    def dispositivo(self):
+        # Adaptador para el motor asíncrono (ingesta.MotorIngesta)
+        return DispositivoSerial(self.id, self.abrir, self.procesar_linea,
+                                 self.error_conexion, self.desconectado, self.separador,
+                                 self.registrar_tramas if self.bitacora is not None else None)
+
+    def enviar_comando(self, state, al_enviar=None):
+        # Espera a que termine el comando en curso, si lo hay
+        with self._comando:
+            return self._enviar_comando(state, al_enviar)
+
+    def iniciar_comando(self, state, al_enviar):
+        # Comandos de /ws: corren en otro hilo, uno por vez por línea. Si ya hay
+        # uno en curso se rechaza (False) en vez de encolar hilos detrás
+        if not self._comando.acquire(blocking=False):
+            return False
+
+        def enviar():
+            try:
+                self._enviar_comando(state, al_enviar)
+            finally:
+                self._comando.release()
+        threading.Thread(target=enviar, daemon=True).start()
+        return True
+
+    def _enviar_comando(self, state, al_enviar):
+        # El comando se repite 3 veces por si el Arduino pierde alguno. al_enviar(mensaje)
+        # se llama una sola vez: tras la primera escritura, sin esperar las
+        # repeticiones, o con el error si no se llegó a escribir
+        message = "❌ Arduino no disponible"
+        arduino = self.arduino
+        if arduino and arduino.is_open:
+            try:
+                command = '1\n' if state.lower() == "on" else '0\n'
+
+                for intento in range(3):
+                    arduino.write(command.encode())
+                    if intento == 0:
+                        self.led_state = state
+                        if al_enviar is not None:
+                            al_enviar(f"✅ Banda {state.upper()} - Comando ejecutado")
+                            al_enviar = None
+                    time.sleep(0.1)
+
+                message = f"✅ Banda {state.upper()} - Comando ejecutado"
+            except Exception as e:
+                message = f"❌ Error: {str(e)}"
+        if al_enviar is not None:
+            al_enviar(message)
+        return message
+
+    def registrar_tramas(self, recibido, tramas):
+        # Solo encola: el hilo escritor de la bitácora hace la E/S
+        if self.bitacora is not None:
+            self.bitacora.agregar_lote(recibido + self._desfase, tramas)
+
+    # ---------- Procesamiento de tramas ----------
+    def procesar_linea(self, linea, recibido=None):
+        if not linea:
+            return
+
+        # JSON, formato antiguo o binario, según el primer byte de la trama
+        trama = parsear_linea(linea)
+        if trama is not None:
+            self.aplicar_trama(trama, time.monotonic() if recibido is None else recibido)
+            return
+
+        # Manejo de comandos simples
+        if b"BANDA:ON" in linea:
+            self.led_state = "on"
+        elif b"BANDA:OFF" in linea:
+            self.led_state = "off"
+
+    def aplicar_trama(self, trama, recibido):
+        anterior = self.estado
+        ir = trama.ir
+        bomba = trama.bomba
+        vasos = anterior.vasos
+        eventos = anterior.eventos
+
+        # Flanco de IR: vaso colocado
+        if ir == 0 and anterior.ir != 0:
+            eventos = self._registrar_evento(TipoEvento.COLOCADO, trama)
+
+        # Flanco de BOMBA: de encendida a apagada = vaso llenado
+        if anterior.bomba and not bomba:
+            vasos += 1
+            eventos = self._registrar_evento(TipoEvento.LLENADO_COMPLETADO, trama)
+
+        # Con valores constantes la versión de /datos no se mueve: el panel recibe 304
+        valores = anterior.valores
+        if (ir, trama.ultra, trama.temp, bomba) != (anterior.ir, anterior.ultra, anterior.temp, anterior.bomba):
+            valores += 1
+        self.estado = Instantanea(anterior.version + 1, valores, ir, trama.ultra, trama.temp, bomba,
+                                  recibido, vasos, eventos)
+        self.historial.agregar(recibido, trama.ultra, trama.temp)
+
+    def _registrar_evento(self, codigo, trama):
+        evento = EventoLlenado(self._nuevo_id(), self.id, codigo, time.time(), trama.ultra, trama.temp)
+        self._eventos.append(evento)
+        if self.almacen is not None:
+            self.almacen.agregar(evento)
+        if self.respaldo is not None:
+            self.respaldo.avisar()
+        # Copia solo en los flancos; las tramas intermedias reutilizan la tupla
+        return tuple(self._eventos)
+
+    # ---------- Modo hilos ----------
+    def conectar(self):
+        while True:
+            try:
+                if self.arduino is None or not self.arduino.is_open:
+                    self.abrir()
+            except Exception as e:
+                self.error_conexion(e)
+
+            time.sleep(3)
+
+    # Productor: solo lee bytes y separa tramas, para no atrasar al puerto serial
+    def leer_serial(self):
+        separador = self.separador
+        puerto_actual = None
+
+        while True:
+            puerto = self.arduino
+            if puerto and puerto.is_open:
+                if puerto is not puerto_actual:
+                    # Nueva conexión: descartar restos de tramas de la anterior
+                    separador.reiniciar()
+                    puerto_actual = puerto
+                try:
+                    # Una sola lectura trae todo lo que haya en el buffer del sistema;
+                    # si está vacío, read() bloquea hasta que llegue al menos un byte
+                    # (o venza el timeout del puerto)
+                    datos = puerto.read(puerto.in_waiting or 1)
+                    if datos:
+                        recibido = time.monotonic()
+                        tramas = separador.alimentar(datos)
+                        self.registrar_tramas(recibido, tramas)
+                        self.cola.poner_lote([(recibido, trama) for trama in tramas])
+                except Exception as e:
+                    print(f"[ERROR] [{self.id}] Lectura serial: {str(e)}")
+                    try:
+                        puerto.flushInput()
+                    except:
+                        pass
+                    separador.reiniciar()
+                    time.sleep(0.1)
+            else:
+                time.sleep(0.1)
+
+    # Consumidor: parsea las tramas y actualiza el estado y los eventos
+    def procesar_tramas(self):
+        while True:
+            for recibido, linea in self.cola.tomar_lote(timeout=1):
+                try:
+                    self.procesar_linea(linea, recibido)
+                except Exception as e:
+                    print(f"[ERROR] [{self.id}] Procesando trama {linea!r}: {str(e)}")
+
+    def iniciar_hilos(self):
+        threading.Thread(target=self.conectar, daemon=True).start()
+        threading.Thread(target=self.leer_serial, daemon=True).start()
+        threading.Thread(target=self.procesar_tramas, daemon=True).start()
+
+    # ---------- Vistas para la API ----------
+    def datos_sensores(self, texto=False):
+        estado = self.estado
+        if texto:
+            # Formato de pantalla, como lo mostraba el panel
+            if estado.version == 0:
+                return {"IR": SIN_DATOS, "ULTRA": SIN_DATOS, "TEMP": SIN_DATOS, "BOMBA": SIN_DATOS}
+            return {
+                "IR": texto_ir(estado.ir),
+                "ULTRA": texto_nivel(estado.ultra),
+                "TEMP": texto_temp(estado.temp),
+                "BOMBA": texto_bomba(estado.bomba)
+            }
+        return {
+            "IR": estado.ir,
+            "ULTRA": estado.ultra,
+            "TEMP": estado.temp,
+            "BOMBA": estado.bomba
+        }
+
+    def estado_conexion(self):
+        # Solo lo que cambia al conectar/desconectar: es la base del ETag de /estado-conexion
+        return {
+            "linea": self.id,
+            "status": self.connection_status,
+            "puerto": self.puerto,
+            "baudios": self.baudios,
+            "disponibles": puertos_disponibles
+        }
+
+    def estadisticas(self):
+        # Contadores que se mueven con cada trama (sin versión: /estadisticas)
+        estado = self.estado
+        return {
+            "linea": self.id,
+            "seq": estado.version,
+            "edad_ms": None if estado.recibido is None else round((time.monotonic() - estado.recibido) * 1000),
+            "tramas_perdidas": self.separador.tramas_perdidas,
+            "errores_crc": self.separador.errores_crc,
+            "cola": self.cola.estadisticas(),
+            "almacen": self.almacen.estadisticas() if self.almacen is not None else None,
+            "bitacora": self.bitacora.estadisticas() if self.bitacora is not None else None
+        }
@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+
+# ============= RESPALDO DEL CONTADOR Y LOS DETECTORES =============
+# Un archivo JSON chico con, por línea, el contador de vasos, el último estado
+# de IR y BOMBA (para no repetir ni perder flancos al reiniciar) y el id del
+# último evento. Lo escribe un hilo propio leyendo la instantánea publicada de
+# cada línea, así quien procesa tramas nunca espera al disco: solo avisa que
+# hubo un cambio. Se guarda como mucho cada `intervalo` segundos, o antes si se
+# juntan `cada` cambios. La escritura es atómica: archivo temporal, fsync y
+# os.replace(), así un corte deja el respaldo anterior o el nuevo, nunca uno a medias.
+INTERVALO_RESPALDO_S = 1.0
+CAMBIOS_POR_RESPALDO = 10
+
+
+class RespaldoEstado:
+    def __init__(self, ruta, intervalo=INTERVALO_RESPALDO_S, cada=CAMBIOS_POR_RESPALDO):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.cada = cada
+        self.lineas = []
+        self.guardados = 0
+        self._cambios = 0
+        self._aviso = threading.Event()
+        self._guardado = None
+        self._lock = threading.Lock()
+        self.datos = self._leer()
+
+    def _leer(self):
+        try:
+            with open(self.ruta, encoding='utf-8') as archivo:
+                return json.load(archivo)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"[⚠️] Respaldo {self.ruta} ilegible, se ignora: {str(e)}")
+            return {}
+
+    def estado_linea(self, id_linea):
+        # Lo guardado para la línea en la ejecución anterior (None si no hay)
+        return self.datos.get(id_linea)
+
+    def vigilar(self, linea):
+        self.lineas.append(linea)
+
+    def avisar(self):
+        # Lo llama quien procesa tramas en cada flanco; solo cuenta
+        self._cambios += 1
+        if self._cambios >= self.cada:
+            self._aviso.set()
+
+    def iniciar(self):
+        threading.Thread(target=self._guardar_periodicamente, daemon=True).start()
+
+    def _guardar_periodicamente(self):
+        while True:
+            self._aviso.wait(self.intervalo)
+            self._aviso.clear()
+            self._cambios = 0
+            try:
+                self.guardar()
+            except OSError as e:
+                print(f"[ERROR] Guardando respaldo {self.ruta}: {str(e)}")
+
+    def guardar(self):
+        datos = {}
+        for linea in self.lineas:
+            estado = linea.estado
+            datos[linea.id] = {
+                "vasos": estado.vasos,
+                "ir": estado.ir,
+                "bomba": estado.bomba,
+                "ultimo_evento": estado.eventos[-1].id if estado.eventos else None
+            }
+        with self._lock:
+            if datos == self._guardado:
+                return
+            temporal = self.ruta + '.tmp'
+            with open(temporal, 'w', encoding='utf-8') as archivo:
+                json.dump(datos, archivo)
+                archivo.flush()
+                os.fsync(archivo.fileno())
+            os.replace(temporal, self.ruta)
+            self._guardado = datos
+            self.guardados += 1
@@ -0,0 +1,320 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import bitacora
+from tramas import parsear_linea
+
+# ============= RETENCIÓN Y MANTENIMIENTO DEL ALMACENAMIENTO =============
+# Cuántos días se guarda cada clase de dato (None = para siempre):
+#   tramas     bitácora cruda de cada línea (bitacora.py)
+#   resumenes  resúmenes de 1 minuto (min/max/media/n/último) en resumenes.db
+#   eventos    eventos de llenado en eventos.db
+# Un hilo de baja prioridad resume cada segmento cerrado de la bitácora en
+# minutos (un segmento sin resumir nunca se borra), borra lo vencido de a
+# pocas filas y devuelve el espacio de SQLite con incremental_vacuum.
+# Trabaja en tramos cortos y duerme entre ellos (Limitador), así no le quita
+# CPU, GIL ni disco a la lectura serial.
+RETENCION_DIAS = {'tramas': 7, 'resumenes': 365, 'eventos': None}
+FRACCION_CPU = 0.1              # parte del tiempo que puede estar trabajando
+BYTES_POR_S = 4 * 1024 * 1024   # caudal de disco máximo (lectura + borrado)
+TRAMO_S = 0.02                  # trabajo seguido máximo antes de ceder
+REVISION_S = 600                # cada cuánto se buscan segmentos y datos vencidos
+FILAS_POR_BORRADO = 2000
+PAGINAS_POR_VACUUM = 256
+RESOLUCION_RESUMEN = 60
+
+ESQUEMA_RESUMENES = """
+CREATE TABLE IF NOT EXISTS resumenes (
+    linea TEXT NOT NULL,
+    sensor TEXT NOT NULL,
+    t REAL NOT NULL,
+    min REAL,
+    max REAL,
+    media REAL,
+    n INTEGER,
+    ultimo REAL,
+    PRIMARY KEY (linea, sensor, t)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS segmentos_resumidos (
+    linea TEXT NOT NULL,
+    segmento TEXT NOT NULL,
+    PRIMARY KEY (linea, segmento)
+) WITHOUT ROWID;
+"""
+
+# Un minuto partido entre dos segmentos se combina con lo ya guardado
+_COMBINAR = """
+INSERT INTO resumenes VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (linea, sensor, t) DO UPDATE SET
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max),
+    media = (media * n + excluded.media * excluded.n) / (n + excluded.n),
+    n = n + excluded.n,
+    ultimo = excluded.ultimo
+"""
+
+
+# ---------- Límites de CPU y disco ----------
+def bajar_prioridad():
+    # En Linux nice es por hilo: solo baja el que llama. En otros sistemas no se toca.
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+
+class Limitador:
+    def __init__(self, fraccion_cpu=FRACCION_CPU, bytes_por_s=BYTES_POR_S, tramo=TRAMO_S):
+        self.fraccion_cpu = fraccion_cpu
+        self.bytes_por_s = bytes_por_s
+        self.tramo = tramo
+        self.dormido = 0.0
+        self._inicio = time.monotonic()
+        self._bytes = 0
+
+    def pausa(self, bytes_usados=0):
+        # Se llama seguido desde los bucles de trabajo: cuando se cumplió un
+        # tramo (o su cuota de disco) duerme lo necesario para respetar ambos límites
+        self._bytes += bytes_usados
+        trabajado = time.monotonic() - self._inicio
+        if trabajado < self.tramo and self._bytes < self.bytes_por_s * self.tramo:
+            return
+        espera = max(trabajado * (1 / self.fraccion_cpu - 1), self._bytes / self.bytes_por_s - trabajado)
+        time.sleep(espera)
+        self.dormido += espera
+        self._inicio = time.monotonic()
+        self._bytes = 0
+
+
+def _abrir(ruta):
+    # auto_vacuum solo se puede elegir antes de crear la primera tabla
+    conexion = sqlite3.connect(ruta)
+    conexion.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conexion.execute("PRAGMA journal_mode=WAL")
+    return conexion
+
+
+def vaciar_incremental(conexion, limitador, paginas=PAGINAS_POR_VACUUM):
+    # Devuelve al sistema las páginas libres de a poco, en vez de un VACUUM
+    # que reescribe toda la base de una vez
+    tamano_pagina = conexion.execute("PRAGMA page_size").fetchone()[0]
+    liberadas = 0
+    while True:
+        libres = conexion.execute("PRAGMA freelist_count").fetchone()[0]
+        if libres == 0:
+            break
+        antes = libres
+        conexion.execute(f"PRAGMA incremental_vacuum({paginas})").fetchall()
+        libres = conexion.execute("PRAGMA freelist_count").fetchone()[0]
+        if libres >= antes:
+            break  # base sin auto_vacuum incremental: no hay nada que hacer
+        liberadas += antes - libres
+        limitador.pausa((antes - libres) * tamano_pagina)
+    if liberadas:
+        # En WAL el archivo se achica al pasar las páginas a la base; PASSIVE no espera a nadie
+        conexion.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+    return liberadas
+
+
+def borrar_anteriores(conexion, tabla, claves, limite, limitador, filas=FILAS_POR_BORRADO):
+    # Borra por tandas cortas para no tener la base bloqueada mucho tiempo
+    borradas = 0
+    while True:
+        with conexion:
+            cursor = conexion.execute(
+                f"DELETE FROM {tabla} WHERE ({claves}) IN "
+                f"(SELECT {claves} FROM {tabla} WHERE t < ? LIMIT ?)", (limite, filas))
+        borradas += cursor.rowcount
+        limitador.pausa()
+        if cursor.rowcount < filas:
+            return borradas
+
+
+# ============= RESÚMENES DE 1 MINUTO (SQLITE) =============
+class AlmacenResumenes:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        conexion = _abrir(ruta)
+        conexion.executescript(ESQUEMA_RESUMENES)
+        conexion.close()
+
+    def _conexion(self):
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta)
+            self._local.conexion = conexion
+        return conexion
+
+    def resumidos(self, linea):
+        filas = self._conexion().execute("SELECT segmento FROM segmentos_resumidos WHERE linea = ?", (linea,))
+        return {segmento for segmento, in filas}
+
+    def guardar_segmento(self, linea, segmento, filas):
+        # Los minutos y la marca del segmento van en la misma transacción:
+        # un corte a la mitad no deja un segmento contado dos veces
+        conexion = self._conexion()
+        with conexion:
+            conexion.executemany(_COMBINAR, filas)
+            conexion.execute("INSERT OR IGNORE INTO segmentos_resumidos VALUES (?, ?)", (linea, segmento))
+
+    def olvidar_segmento(self, linea, segmento):
+        conexion = self._conexion()
+        with conexion:
+            conexion.execute("DELETE FROM segmentos_resumidos WHERE linea = ? AND segmento = ?", (linea, segmento))
+
+    def primero(self, linea, sensor):
+        # Minuto más viejo guardado (None si no hay)
+        return self._conexion().execute("SELECT MIN(t) FROM resumenes WHERE linea = ? AND sensor = ?",
+                                        (linea, sensor)).fetchone()[0]
+
+    def consultar(self, linea, sensor, desde=None, hasta=None, puntos=2000):
+        # Mismo formato que HistorialSensores.consultar; si el rango tiene más
+        # de `puntos` minutos se agrupan en intervalos más largos
+        conexion = self._conexion()
+        if desde is None:
+            desde = self.primero(linea, sensor) or 0.0
+        if hasta is None:
+            hasta = time.time()
+        paso = max(1, math.ceil((hasta - desde) / RESOLUCION_RESUMEN / puntos)) * RESOLUCION_RESUMEN
+        # ultimo sale de la fila más nueva de cada grupo
+        filas = conexion.execute(
+            "SELECT g.bloque, g.minimo, g.maximo, g.media, g.n, r.ultimo FROM ("
+            "SELECT CAST(t / ? AS INTEGER) * ? AS bloque, MIN(min) AS minimo, MAX(max) AS maximo, "
+            "SUM(media * n) / SUM(n) AS media, SUM(n) AS n, MAX(t) AS t_ultimo FROM resumenes "
+            "WHERE linea = ? AND sensor = ? AND t >= ? AND t <= ? GROUP BY bloque) AS g "
+            "JOIN resumenes AS r ON r.linea = ? AND r.sensor = ? AND r.t = g.t_ultimo ORDER BY g.bloque",
+            (paso, paso, linea, sensor, desde, hasta, linea, sensor)).fetchall()
+        respuesta = {"resolucion": paso}
+        for i, columna in enumerate(('t', 'min', 'max', 'media', 'n', 'ultimo')):
+            respuesta[columna] = [fila[i] for fila in filas]
+        respuesta["v"] = respuesta["media"]
+        return respuesta
+
+
+def resumir_segmento(directorio, inicio, fin, limitador):
+    # Filas (sensor, minuto, min, max, media, n, último) de las tramas del
+    # segmento que empieza en `inicio`; `fin` es el inicio del siguiente
+    minutos = {}
+    leidas = 0
+    bytes_leidos = 0
+    for t, trama in bitacora.leer_tramas(directorio, inicio, fin):
+        if t >= fin:
+            break
+        leidas += 1
+        bytes_leidos += len(trama) + 10
+        if leidas % 256 == 0:
+            limitador.pausa(bytes_leidos)
+            bytes_leidos = 0
+        trama = parsear_linea(bytes(trama))
+        if trama is None:
+            continue
+        minuto = t - t % RESOLUCION_RESUMEN
+        for sensor, valor in (('ULTRA', trama.ultra), ('TEMP', trama.temp)):
+            if valor is None:
+                continue
+            acumulado = minutos.get((sensor, minuto))
+            if acumulado is None:
+                minutos[(sensor, minuto)] = [valor, valor, valor, 1, valor]
+            else:
+                if valor < acumulado[0]:
+                    acumulado[0] = valor
+                if valor > acumulado[1]:
+                    acumulado[1] = valor
+                acumulado[2] += valor
+                acumulado[3] += 1
+                acumulado[4] = valor
+    return [(sensor, minuto, minimo, maximo, suma / cuenta, cuenta, ultimo)
+            for (sensor, minuto), (minimo, maximo, suma, cuenta, ultimo) in sorted(minutos.items())]
+
+
+# ============= HILO DE MANTENIMIENTO =============
+class MantenimientoAlmacenamiento:
+    def __init__(self, resumenes, directorios_bitacora, ruta_eventos, retencion=None,
+                 revision=REVISION_S, limitador=None, archivado=None):
+        self.resumenes = resumenes
+        self.directorios_bitacora = directorios_bitacora  # {id de línea: directorio}
+        self.ruta_eventos = ruta_eventos
+        # archivado(inicio, fin): True si el archivo columnar ya tiene esos días.
+        # Con archivo, un segmento vencido no se borra hasta que esté compactado
+        self.archivado = archivado
+        self.retencion = dict(RETENCION_DIAS, **(retencion or {}))
+        self.revision = revision
+        self.limitador = limitador or Limitador()
+
+    def iniciar(self):
+        threading.Thread(target=self._mantener_periodicamente, daemon=True).start()
+
+    def _mantener_periodicamente(self):
+        bajar_prioridad()
+        while True:
+            try:
+                self.mantener()
+            except Exception as e:
+                print(f"[ERROR] Mantenimiento del almacenamiento: {str(e)}")
+            time.sleep(self.revision)
+
+    def _limite(self, clase, ahora):
+        dias = self.retencion.get(clase)
+        return None if dias is None else ahora - dias * 86400
+
+    def mantener(self, ahora=None):
+        ahora = time.time() if ahora is None else ahora
+        hecho = {"segmentos_resumidos": 0, "segmentos_borrados": 0, "resumenes_borrados": 0,
+                 "eventos_borrados": 0}
+        limite_tramas = self._limite('tramas', ahora)
+        for id_linea, directorio in self.directorios_bitacora.items():
+            if not os.path.isdir(directorio):
+                continue
+            resumidos, borrados = self._tramas_linea(id_linea, directorio, limite_tramas)
+            hecho["segmentos_resumidos"] += resumidos
+            hecho["segmentos_borrados"] += borrados
+
+        limite = self._limite('resumenes', ahora)
+        if limite is not None:
+            conexion = self.resumenes._conexion()
+            hecho["resumenes_borrados"] = borrar_anteriores(conexion, 'resumenes', 'linea, sensor, t',
+                                                            limite, self.limitador)
+            vaciar_incremental(conexion, self.limitador)
+
+        limite = self._limite('eventos', ahora)
+        if limite is not None and os.path.exists(self.ruta_eventos):
+            conexion = sqlite3.connect(self.ruta_eventos)
+            try:
+                hecho["eventos_borrados"] = borrar_anteriores(conexion, 'eventos', 'id', limite, self.limitador)
+                vaciar_incremental(conexion, self.limitador)
+            finally:
+                conexion.close()
+
+        if any(hecho.values()):
+            print(f"🧹 Mantenimiento: {hecho}")
+        return hecho
+
+    def _tramas_linea(self, id_linea, directorio, limite):
+        resumidos = self.resumenes.resumidos(id_linea)
+        lista = bitacora.segmentos(directorio)
+        hechos = borrados = 0
+        # El último segmento puede ser el activo; solo se tocan los cerrados y comprimidos
+        for (inicio, base), (fin, _) in zip(lista, lista[1:]):
+            if not os.path.exists(base + '.seg.gz') or os.path.exists(base + '.seg'):
+                continue
+            nombre = os.path.basename(base)
+            if nombre not in resumidos:
+                filas = resumir_segmento(directorio, inicio, fin, self.limitador)
+                self.resumenes.guardar_segmento(id_linea, nombre, [(id_linea,) + fila for fila in filas])
+                resumidos.add(nombre)
+                hechos += 1
+            if limite is not None and fin < limite and (self.archivado is None or self.archivado(inicio, fin)):
+                tamano = os.path.getsize(base + '.seg.gz')
+                for extension in ('.seg.gz', '.idx'):
+                    try:
+                        os.remove(base + extension)
+                    except FileNotFoundError:
+                        pass
+                self.resumenes.olvidar_segmento(id_linea, nombre)
+                borrados += 1
+                self.limitador.pausa(tamano)
+        return hechos, borrados
@@ -0,0 +1,417 @@
+import argparse
+import binascii
+import math
+import multiprocessing
+import os
+import pty
+import select
+import sys
+import termios
+import threading
+import time
+import tty
+
+import bitacora
+from tramas import SeparadorTramas, Trama, codificar_binaria
+
+# ============= ARDUINO VIRTUAL =============
+# Dispositivo falso sobre un pseudo-terminal de Linux: el programa abre
+# self.puerto (p. ej. /dev/pts/5) igual que abriría /dev/ttyACM0.
+FORMATOS = ('json', 'legado', 'binario')
+
+# Ciclo de llenado por defecto: (duración s, IR, BOMBA, nivel inicial cm, nivel final cm)
+CICLO_LLENADO = [
+    (1.0, 1, False, 15.0, 15.0),   # banda en movimiento, sin vaso
+    (0.5, 0, False, 15.0, 15.0),   # vaso colocado bajo la boquilla
+    (2.0, 0, True, 15.0, 3.0),     # bomba llenando
+    (0.5, 0, False, 3.0, 3.0),     # llenado completo, el vaso sigue ahí
+]
+
+# Cada cuánto se despierta el emisor; las tramas vencidas se escriben juntas,
+# así se alcanzan miles de tramas por segundo sin un sleep() por trama
+TICK_S = 0.001
+
+
+def codificar_trama(trama, formato, seq=0):
+    if formato == 'binario':
+        return codificar_binaria(trama, seq)
+    temp = 'null' if trama.temp is None else trama.temp
+    if formato == 'legado':
+        return f"IR:{trama.ir},ULTRA:{trama.ultra},TEMP:{temp},BOMBA:{int(trama.bomba)}\r\n".encode()
+    bomba = "ON" if trama.bomba else "OFF"
+    return f'{{"IR":{trama.ir},"ULTRA":{trama.ultra},"TEMP":{temp},"BOMBA":"{bomba}"}}\r\n'.encode()
+
+
+def trama_del_ciclo(ciclo, t):
+    duracion_total = sum(fase[0] for fase in ciclo)
+    t = t % duracion_total
+    for duracion, ir, bomba, nivel_inicio, nivel_fin in ciclo:
+        if t < duracion:
+            nivel = nivel_inicio + (nivel_fin - nivel_inicio) * t / duracion
+            break
+        t -= duracion
+    else:
+        nivel = nivel_fin
+    temp = 24.5 + 0.5 * math.sin(t)
+    return Trama(ir, round(nivel, 1), round(temp, 2), bomba)
+
+
+# ============= CAPTURAS =============
+# Una trama por línea: "<segundos desde el inicio>\t<t|b>\t<trama>"
+# t = trama de texto tal cual, b = trama binaria en hexadecimal
+def cargar_captura(ruta):
+    tramas = []
+    with open(ruta, encoding='utf-8') as archivo:
+        for renglon in archivo:
+            renglon = renglon.rstrip('\r\n')
+            if not renglon or renglon.startswith('#'):
+                continue
+            tiempo, tipo, trama = renglon.split('\t', 2)
+            if tipo == 'b':
+                datos = binascii.unhexlify(trama)
+            else:
+                datos = trama.encode() + b'\r\n'
+            tramas.append((float(tiempo), datos))
+    return tramas
+
+
+def grabar_captura(puerto, baudios, ruta, duracion):
+    import serial
+
+    separador = SeparadorTramas()
+    conexion = serial.Serial(puerto, baudios, timeout=0.1)
+    inicio = time.monotonic()
+    total = 0
+    with conexion, open(ruta, 'w', encoding='utf-8') as archivo:
+        while time.monotonic() - inicio < duracion:
+            datos = conexion.read(conexion.in_waiting or 1)
+            ahora = time.monotonic() - inicio
+            for trama in separador.alimentar(datos):
+                if trama[0] == 0xA5:
+                    archivo.write(f"{ahora:.6f}\tb\t{trama.hex()}\n")
+                else:
+                    archivo.write(f"{ahora:.6f}\tt\t{trama.decode('utf-8', errors='replace')}\n")
+                total += 1
+    return total
+
+
+class ArduinoVirtual:
+    def __init__(self, formato='json', baudios=115200, frecuencia=20, ciclo=CICLO_LLENADO,
+                 captura=None, velocidad=1.0):
+        if formato not in FORMATOS:
+            raise ValueError(f"Formato desconocido: {formato}")
+        self.formato = formato
+        self.baudios = baudios
+        self.frecuencia = frecuencia
+        self.ciclo = ciclo
+        # Reproducción: lista de (segundos, bytes); velocidad None = lo más rápido posible
+        self.captura = captura
+        self.velocidad = velocidad
+
+        self.banda = "off"
+        self.enviadas = 0
+        self.desbordadas = 0
+        self.comandos = 0
+
+        self.maestro, self.esclavo = pty.openpty()
+        tty.setraw(self.esclavo)
+        # Si nadie lee el puerto, se descartan tramas como haría la UART real
+        os.set_blocking(self.maestro, False)
+        self.puerto = os.ttyname(self.esclavo)
+
+        self._velocidad_serial = getattr(termios, f"B{baudios}")
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def velocidad_correcta(self):
+        # El maestro ve la configuración termios que el programa puso en el esclavo
+        return termios.tcgetattr(self.maestro)[4] == self._velocidad_serial
+
+    def generar_trama(self, t):
+        return trama_del_ciclo(self.ciclo, t)
+
+    def escribir(self, datos, tramas=1, esperar=False):
+        if not self.velocidad_correcta():
+            # A otra velocidad la UART solo recibe ruido
+            datos = os.urandom(len(datos))
+        vista = memoryview(datos)
+        while vista:
+            try:
+                escritos = os.write(self.maestro, vista)
+            except BlockingIOError:
+                if not esperar:
+                    # Buffer lleno: el resto se pierde (y puede cortar una trama)
+                    self.desbordadas += round(tramas * len(vista) / len(datos))
+                    break
+                select.select([], [self.maestro], [], 0.1)
+                continue
+            vista = vista[escritos:]
+        self.enviadas += tramas - round(tramas * len(vista) / len(datos))
+
+    def atender_comandos(self):
+        # El firmware real recibe '1\n' / '0\n' y confirma con BANDA:ON / BANDA:OFF
+        try:
+            comandos = os.read(self.maestro, 256)
+        except (BlockingIOError, OSError):
+            return
+        for comando in comandos.split():
+            if comando in (b'1', b'0'):
+                self.banda = "on" if comando == b'1' else "off"
+                self.comandos += 1
+                self.escribir(b"BANDA:ON\r\n" if self.banda == "on" else b"BANDA:OFF\r\n")
+
+    def _emitir(self):
+        inicio = time.perf_counter()
+        seq = 0
+        while not self._detener.is_set():
+            ahora = time.perf_counter() - inicio
+            vencidas = int(ahora * self.frecuencia) - seq
+            if vencidas > 0:
+                lote = bytearray()
+                for i in range(vencidas):
+                    t = (seq + i) / self.frecuencia
+                    lote += codificar_trama(self.generar_trama(t), self.formato, seq + i)
+                seq += vencidas
+                self.escribir(lote, vencidas)
+            self.atender_comandos()
+            time.sleep(TICK_S)
+
+    def _reproducir(self):
+        inicio = time.perf_counter()
+        for tiempo, datos in self.captura:
+            if self._detener.is_set():
+                return
+            if self.velocidad:
+                espera = tiempo / self.velocidad - (time.perf_counter() - inicio)
+                if espera > 0:
+                    time.sleep(espera)
+            self.escribir(datos, esperar=not self.velocidad)
+            self.atender_comandos()
+
+    def iniciar(self):
+        objetivo = self._reproducir if self.captura is not None else self._emitir
+        self._hilo = threading.Thread(target=objetivo, daemon=True)
+        self._hilo.start()
+        return self
+
+    def esperar(self):
+        self._hilo.join()
+
+    def cerrar(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+        os.close(self.maestro)
+        os.close(self.esclavo)
+
+
+# ============= PRUEBA DE CARGA =============
+# Los Arduinos virtuales corren en otro proceso para no competir por el GIL
+# con el programa bajo prueba (LineaLlenado + motor de ingesta). La CPU y la
+# memoria que se informan son solo las de ese programa, no las del simulador.
+def rss_mb():
+    # Memoria residente actual (Linux: /proc/self/status, VmRSS en kB)
+    with open('/proc/self/status') as estado:
+        for renglon in estado:
+            if renglon.startswith('VmRSS:'):
+                return int(renglon.split()[1]) / 1024
+    return None
+
+
+def _proceso_simuladores(cantidad, formato, baudios, frecuencia, canal, detener):
+    arduinos = [ArduinoVirtual(formato, baudios, frecuencia).iniciar() for _ in range(cantidad)]
+    canal.send([arduino.puerto for arduino in arduinos])
+    canal.recv()  # las líneas ya detectaron la velocidad: empieza la medición
+    canal.send([(arduino.enviadas, arduino.desbordadas) for arduino in arduinos])
+    detener.wait()
+    canal.send([(arduino.enviadas, arduino.desbordadas) for arduino in arduinos])
+    for arduino in arduinos:
+        arduino.cerrar()
+
+
+def prueba_estres(frecuencia, duracion, formato='json', lineas=1, modo='asyncio', baudios=115200,
+                  directorio_bitacora=None):
+    from ingesta import MotorIngesta
+    from lineas import LineaLlenado
+
+    canal, canal_hijo = multiprocessing.Pipe()
+    detener = multiprocessing.Event()
+    proceso = multiprocessing.Process(target=_proceso_simuladores,
+                                      args=(lineas, formato, baudios, frecuencia, canal_hijo, detener))
+    proceso.start()
+    puertos = canal.recv()
+
+    rss_inicial = rss_mb()
+    lineas_llenado = [
+        LineaLlenado(f"sim{i}", puerto, puerto_alternativo=False,
+                     bitacora=bitacora.BitacoraTramas(os.path.join(directorio_bitacora, f"sim{i}"))
+                     if directorio_bitacora else None)
+        for i, puerto in enumerate(puertos)
+    ]
+    if modo == 'asyncio':
+        motor = MotorIngesta([linea.dispositivo() for linea in lineas_llenado])
+        threading.Thread(target=motor.ejecutar, daemon=True).start()
+    else:
+        for linea in lineas_llenado:
+            linea.iniciar_hilos()
+
+    # La conexión incluye la detección de baudios contra el simulador
+    while not all(linea.connection_status == "Conectado" for linea in lineas_llenado):
+        time.sleep(0.05)
+
+    canal.send(True)
+    enviadas_inicio = canal.recv()
+    procesadas_inicio = [linea.estado.version for linea in lineas_llenado]
+    # time.process_time(): CPU (usuario + sistema) de todos los hilos del proceso
+    cpu_inicio, reloj_inicio = time.process_time(), time.perf_counter()
+    time.sleep(duracion)
+    cpu = (time.process_time() - cpu_inicio) / (time.perf_counter() - reloj_inicio)
+    recursos = {
+        "cpu_pct": round(cpu * 100, 1),
+        "rss_inicial_mb": round(rss_inicial, 1),
+        "rss_mb": round(rss_mb(), 1),
+        "historial_mb": round(sum(linea.historial.memoria() for linea in lineas_llenado) / 2 ** 20, 1),
+    }
+    detener.set()
+    envios = canal.recv()
+    proceso.join()
+    time.sleep(0.5)  # dejar que se procese lo que quedó en el buffer
+    for linea in lineas_llenado:
+        if linea.bitacora is not None:
+            linea.bitacora.detener()  # escribe lo que quedó pendiente
+
+    resultados = []
+    for linea, (enviadas, desbordadas), (enviadas_0, desbordadas_0), procesadas_0 in zip(
+            lineas_llenado, envios, enviadas_inicio, procesadas_inicio):
+        procesadas = linea.estado.version - procesadas_0
+        resultados.append({
+            "linea": linea.id,
+            "enviadas": enviadas - enviadas_0,
+            "desbordadas": desbordadas - desbordadas_0,
+            "procesadas": procesadas,
+            "tramas_s": round(procesadas / duracion),
+            "cola": linea.cola.estadisticas() if modo == 'hilos' else None,
+            "bitacora": linea.bitacora.estadisticas() if linea.bitacora is not None else None
+        })
+    return resultados, recursos
+
+
+def _escala_en_proceso(canal, *argumentos):
+    canal.send(prueba_estres(*argumentos))
+
+
+def prueba_escala(cantidades, frecuencia, duracion, formato='json', modo='asyncio'):
+    # Una prueba de carga por cantidad de líneas, cada una en un proceso nuevo:
+    # la memoria que libera una corrida no vuelve al sistema y falsearía la siguiente
+    filas = []
+    for cantidad in cantidades:
+        canal, canal_hijo = multiprocessing.Pipe()
+        proceso = multiprocessing.Process(target=_escala_en_proceso,
+                                          args=(canal_hijo, frecuencia, duracion, formato, cantidad, modo))
+        proceso.start()
+        resultados, recursos = canal.recv()
+        proceso.join()
+        filas.append((cantidad, sum(r['tramas_s'] for r in resultados), recursos))
+    return filas
+
+
+# ============= USO DESDE CONSOLA =============
+def main():
+    parser = argparse.ArgumentParser(description="Arduino virtual sobre un pty")
+    sub = parser.add_subparsers(dest='comando')
+
+    emular = sub.add_parser('emular', help="emitir tramas del ciclo de llenado")
+    emular.add_argument('--formato', choices=FORMATOS, default='json')
+    emular.add_argument('--baudios', type=int, default=115200)
+    emular.add_argument('--frecuencia', type=float, default=20, help="tramas por segundo")
+
+    reproducir = sub.add_parser('reproducir', help="reproducir una captura o un rango de la bitácora")
+    reproducir.add_argument('captura', help="archivo de captura o directorio de bitácora (tramas/linea1)")
+    reproducir.add_argument('--desde', type=bitacora.fecha, help="solo bitácora: epoch o AAAA-MM-DDTHH:MM:SS")
+    reproducir.add_argument('--hasta', type=bitacora.fecha)
+    reproducir.add_argument('--baudios', type=int, default=115200)
+    reproducir.add_argument('--velocidad', default='1', help="factor de tiempo, o 'max'")
+
+    grabar = sub.add_parser('grabar', help="grabar una captura desde un puerto real")
+    grabar.add_argument('puerto')
+    grabar.add_argument('salida')
+    grabar.add_argument('--baudios', type=int, default=115200)
+    grabar.add_argument('--duracion', type=float, default=60)
+
+    estres = sub.add_parser('estres', help="prueba de carga de la ingesta completa")
+    estres.add_argument('--formato', choices=FORMATOS, default='json')
+    estres.add_argument('--frecuencia', type=float, default=1000, help="tramas por segundo por línea")
+    estres.add_argument('--duracion', type=float, default=10)
+    estres.add_argument('--lineas', type=int, default=1)
+    estres.add_argument('--modo', choices=('asyncio', 'hilos'), default='asyncio')
+    estres.add_argument('--bitacora', help="directorio para registrar también las tramas crudas")
+    estres.add_argument('--max-perdidas', type=float, default=0.01,
+                        help="fracción de tramas perdidas tolerada (código de salida 1 si se supera)")
+
+    escala = sub.add_parser('escala', help="CPU y memoria de la ingesta según la cantidad de líneas")
+    escala.add_argument('--lineas', type=int, nargs='+', default=[1, 4, 16])
+    escala.add_argument('--formato', choices=FORMATOS, default='json')
+    escala.add_argument('--frecuencia', type=float, default=200, help="tramas por segundo por línea")
+    escala.add_argument('--duracion', type=float, default=10)
+    escala.add_argument('--modo', choices=('asyncio', 'hilos'), default='asyncio')
+
+    args = parser.parse_args()
+
+    if args.comando == 'escala':
+        for cantidad, tramas_s, recursos in prueba_escala(args.lineas, args.frecuencia, args.duracion,
+                                                          args.formato, args.modo):
+            lineas_mb = recursos['rss_mb'] - recursos['rss_inicial_mb']
+            print(f"📈 {cantidad} líneas: {tramas_s} tramas/s, CPU {recursos['cpu_pct']}%, "
+                  f"RSS {recursos['rss_mb']:.1f} MB (+{lineas_mb:.1f} MB por las líneas, "
+                  f"{lineas_mb / cantidad:.1f} MB cada una; historial {recursos['historial_mb']:.1f} MB)")
+        return
+
+    if args.comando == 'estres':
+        resultados, recursos = prueba_estres(args.frecuencia, args.duracion, args.formato, args.lineas, args.modo,
+                                   directorio_bitacora=args.bitacora)
+        fallo = False
+        for r in resultados:
+            # Las tramas en vuelo al empezar la medición pueden dar un valor levemente negativo
+            perdidas = max(0.0, 1 - r['procesadas'] / max(r['enviadas'], 1))
+            fallo |= perdidas > args.max_perdidas
+            print(f"📈 {r['linea']}: {r['procesadas']}/{r['enviadas']} tramas "
+                  f"({r['tramas_s']} tramas/s, pérdidas {perdidas:.2%}, desbordes {r['desbordadas']})")
+            if r['bitacora'] is not None:
+                print(f"💾 {r['linea']}: bitácora {r['bitacora']['registros']} tramas, "
+                      f"{r['bitacora']['descartadas']} descartadas")
+        print(f"🧮 CPU {recursos['cpu_pct']}%, RSS {recursos['rss_mb']:.1f} MB "
+              f"({recursos['rss_inicial_mb']:.1f} MB antes de crear las líneas)")
+        sys.exit(1 if fallo else 0)
+
+    if args.comando == 'grabar':
+        total = grabar_captura(args.puerto, args.baudios, args.salida, args.duracion)
+        print(f"💾 {total} tramas guardadas en {args.salida}")
+        return
+
+    if args.comando == 'reproducir':
+        velocidad = None if args.velocidad == 'max' else float(args.velocidad)
+        if os.path.isdir(args.captura):
+            captura = bitacora.captura(args.captura, args.desde, args.hasta)
+        else:
+            captura = cargar_captura(args.captura)
+        arduino = ArduinoVirtual(baudios=args.baudios, captura=captura, velocidad=velocidad)
+        descripcion = f"reproduciendo {args.captura} a velocidad {args.velocidad}"
+    else:
+        formato = getattr(args, 'formato', 'json')
+        baudios = getattr(args, 'baudios', 115200)
+        frecuencia = getattr(args, 'frecuencia', 20)
+        arduino = ArduinoVirtual(formato, baudios, frecuencia)
+        descripcion = f"{formato}, {frecuencia:g} tramas/s"
+
+    arduino.iniciar()
+    print(f"🤖 Arduino virtual en {arduino.puerto} ({descripcion}, {arduino.baudios} baudios)")
+    try:
+        while arduino._hilo.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    arduino.cerrar()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import time
+
+from eventos import AlmacenEventos, TipoEvento
+from lineas import LineaLlenado
+from respaldo import RespaldoEstado
+from tramas import Trama
+
+# ============= REINICIO CON RESPALDO Y ALMACÉN =============
+# Un corte puede dejar el respaldo (respaldo.py) hasta un segundo atrás del
+# almacén de eventos: al reiniciar, el contador no debe perder ni repetir llenados.
+# Se corre con: python -m pytest test_respaldo.py
+
+
+def abrir(directorio):
+    almacen = AlmacenEventos(str(directorio / 'eventos.db'), intervalo=0.01)
+    respaldo = RespaldoEstado(str(directorio / 'respaldo.json'))
+    linea = LineaLlenado("linea1", "COM_PRUEBA", almacen=almacen, respaldo=respaldo,
+                         muestras_historial=16)
+    respaldo.vigilar(linea)
+    return almacen, respaldo, linea
+
+
+def trama(linea, ir, bomba):
+    linea.aplicar_trama(Trama(ir, 10.0, 24.5, bomba), time.monotonic())
+
+
+def llenados(linea):
+    return sum(1 for evento in linea.estado.eventos if evento.codigo == TipoEvento.LLENADO_COMPLETADO)
+
+
+def test_llenado_posterior_al_respaldo(tmp_path):
+    almacen, respaldo, linea = abrir(tmp_path)
+    trama(linea, 1, False)
+    trama(linea, 0, False)  # vaso colocado
+    trama(linea, 0, True)   # bomba encendida
+    respaldo.guardar()
+    trama(linea, 0, False)  # llenado completado: llega al almacén, no al respaldo
+    almacen.detener()       # corte
+    assert linea.estado.vasos == 1
+
+    almacen, respaldo, linea = abrir(tmp_path)
+    assert linea.estado.vasos == 1
+    trama(linea, 0, False)  # la bomba sigue apagada: no es otro llenado
+    trama(linea, 1, False)
+    assert linea.estado.vasos == 1
+    assert llenados(linea) == 1
+    almacen.detener()
+
+
+def test_bomba_encendida_al_cortar(tmp_path):
+    # Último evento COLOCADO y la bomba ya encendida: el llenado se cuenta al apagarse
+    almacen, respaldo, linea = abrir(tmp_path)
+    trama(linea, 1, False)
+    respaldo.guardar()
+    trama(linea, 0, False)
+    trama(linea, 0, True)
+    almacen.detener()
+
+    almacen, respaldo, linea = abrir(tmp_path)
+    trama(linea, 0, True)
+    trama(linea, 0, False)
+    assert linea.estado.vasos == 1
+    assert llenados(linea) == 1
+    almacen.detener()
+
+
+def test_respaldo_al_dia(tmp_path):
+    # Sin eventos posteriores al respaldo se usan sus detectores tal cual
+    almacen, respaldo, linea = abrir(tmp_path)
+    trama(linea, 1, False)
+    trama(linea, 0, False)
+    trama(linea, 0, True)
+    trama(linea, 0, False)
+    trama(linea, 0, True)   # segundo llenado en curso
+    respaldo.guardar()
+    almacen.detener()
+
+    almacen, respaldo, linea = abrir(tmp_path)
+    assert (linea.estado.vasos, linea.estado.bomba) == (1, True)
+    trama(linea, 0, False)
+    assert linea.estado.vasos == 2
+    almacen.detener()
@@ -0,0 +1,123 @@
+import random
+import re
+
+from tramas import (SINCRONIA, SeparadorTramas, Trama, codificar_binaria, parsear_legado,
+                    parsear_linea)
+
+# ============= FUZZ DEL PARSER DE TRAMAS =============
+# Líneas mal formadas de los tres formatos: el parser nunca debe lanzar una
+# excepción ni aceptar una trama con tipos incorrectos. Semilla fija para que
+# una falla se pueda repetir. Se corre con: python -m pytest test_tramas.py
+SEMILLA = 1
+MUTACIONES = 50000
+
+LEGADO = b'IR:0,ULTRA:12.3,TEMP:24.5,BOMBA:1'
+JSON = b'{"IR":0,"ULTRA":12.3,"TEMP":24.5,"BOMBA":"ON"}'
+# Bytes que más fácil rompen cada formato a medias
+ALFABETO = b'IRULTAEMPBOMNF:,.{}[]"-+eE0123456789 \x00\xa5\xff\r\t'
+
+# Patrón del parser original (re.match sobre el texto): el nuevo debe aceptar lo mismo
+PATRON_ORIGINAL = r'IR:\d+,ULTRA:\d+\.?\d*,TEMP:\d+\.?\d*,BOMBA:[01]'
+
+
+def mutar(aleatorio, base):
+    linea = bytearray(base)
+    for _ in range(aleatorio.randint(1, 4)):
+        operacion = aleatorio.random()
+        posicion = aleatorio.randrange(len(linea) + 1)
+        if operacion < 0.4 and linea:
+            del linea[min(posicion, len(linea) - 1)]
+        elif operacion < 0.8:
+            linea.insert(posicion, aleatorio.choice(ALFABETO))
+        elif linea:
+            linea[min(posicion, len(linea) - 1)] = aleatorio.choice(ALFABETO)
+    return bytes(linea)
+
+
+def tipos_validos(trama):
+    return (type(trama.ir) is int and type(trama.ultra) is float
+            and (trama.temp is None or type(trama.temp) is float) and type(trama.bomba) is bool)
+
+
+def test_legado_mutado():
+    aleatorio = random.Random(SEMILLA)
+    for _ in range(MUTACIONES):
+        linea = mutar(aleatorio, LEGADO)
+        if linea[:1] == bytes([SINCRONIA]):
+            continue  # solo el separador entrega líneas con 0xA5 al principio
+        trama = parsear_linea(linea)
+        if trama is not None:
+            assert tipos_validos(trama), linea
+        # Mismo criterio que el código anterior: re.match sobre el texto ASCII
+        if linea.isascii():
+            original = re.match(PATRON_ORIGINAL, linea.decode()) is not None
+            assert (parsear_legado(linea) is not None) == original, linea
+            if linea[:1] == b'I':
+                assert (trama is not None) == original, linea
+
+
+def test_json_mutado():
+    aleatorio = random.Random(SEMILLA)
+    for _ in range(MUTACIONES):
+        linea = mutar(aleatorio, JSON)
+        if linea[:1] == bytes([SINCRONIA]):
+            continue
+        trama = parsear_linea(linea)
+        if trama is not None:
+            assert tipos_validos(trama), linea
+
+
+def test_json_invalido():
+    for linea in (b'{', b'{}', b'[1]', b'{"IR":0}', b'{"IR":0,"ULTRA":"x","TEMP":1,"BOMBA":"ON"}',
+                  b'{"IR":true,"ULTRA":1,"TEMP":1,"BOMBA":"ON"}', b'{"IR":0,"ULTRA":1,"TEMP":"e","BOMBA":"ON"}',
+                  b'{"IR":0,"ULTRA":1,"TEMP":1,"BOMBA":"SI"}', b'{"IR":0,"ULTRA":1,"TEMP":1,"BOMBA":"ON"}x',
+                  b'{"IR":0,"ULTRA":1,"TEMP":1,"BOMBA":"ON"\xff}'):
+        assert parsear_linea(linea) is None, linea
+    assert parsear_linea(b'{"IR":0,"ULTRA":1,"TEMP":null,"BOMBA":"OFF"}') == Trama(0, 1.0, None, False)
+
+
+def test_bytes_aleatorios():
+    # Ruido de línea (baudios incorrectos, cable suelto) por el separador, como en la lectura real
+    aleatorio = random.Random(SEMILLA)
+    separador = SeparadorTramas()
+    for _ in range(MUTACIONES):
+        datos = bytes(aleatorio.randrange(256) for _ in range(aleatorio.randint(0, 80)))
+        for linea in separador.alimentar(datos):
+            trama = parsear_linea(linea)
+            if trama is not None:
+                assert tipos_validos(trama), linea
+
+
+def test_binaria_corrupta():
+    # Un bit cambiado en cualquier byte de una trama binaria: el CRC la rechaza
+    # y el separador se vuelve a sincronizar con la siguiente
+    aleatorio = random.Random(SEMILLA)
+    trama = Trama(0, 12.3, 24.5, True)
+    for seq in range(MUTACIONES // 10):
+        buena = codificar_binaria(trama, seq)
+        rota = bytearray(buena)
+        rota[aleatorio.randrange(1, len(rota))] ^= 1 << aleatorio.randrange(8)
+        separador = SeparadorTramas()
+        recibidas = separador.alimentar(bytes(rota) + buena)
+        # Un bit cambiado puede dejar un '\n' suelto: esa basura sale como línea de texto inválida
+        assert [linea for linea in recibidas if linea[0] == SINCRONIA] == [buena]
+        assert all(parsear_linea(linea) is None for linea in recibidas[:-1])
+
+
+def test_separador_en_trozos():
+    # Cortar el flujo en cualquier punto no cambia las tramas que salen
+    aleatorio = random.Random(SEMILLA)
+    flujo = b''
+    for seq in range(500):
+        flujo += aleatorio.choice((LEGADO + b'\r\n', JSON + b'\n', codificar_binaria(Trama(1, 3.0, None, False), seq),
+                                   mutar(aleatorio, LEGADO) + b'\n'))
+    esperadas = SeparadorTramas().alimentar(flujo)
+    for _ in range(200):
+        separador = SeparadorTramas()
+        recibidas = []
+        inicio = 0
+        while inicio < len(flujo):
+            fin = inicio + aleatorio.randint(1, 64)
+            recibidas += separador.alimentar(flujo[inicio:fin])
+            inicio = fin
+        assert recibidas == esperadas
@@ -0,0 +1,218 @@
+import json
+import re
+import struct
+from binascii import crc_hqx
+from collections import namedtuple
+from typing import Literal, Optional
+
+# Decodificadores JSON opcionales, de más rápido a más lento
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ============= TRAMA DECODIFICADA =============
+# ir: 0 = vaso detectado, ultra: nivel en cm, temp: °C (None si no es válida),
+# bomba: True = encendida, seq: número de secuencia (solo tramas binarias)
+Trama = namedtuple('Trama', ['ir', 'ultra', 'temp', 'bomba', 'seq'], defaults=[None])
+
+# ============= FORMATO BINARIO =============
+# 10 bytes, little endian:
+#   0xA5 | seq u16 | banderas u8 | ultra u16 (mm) | temp i16 (centésimas de °C) | crc u16
+# banderas: bit 0 = IR, bit 1 = BOMBA. temp = -32768 indica sensor sin lectura.
+# El CRC es CRC-16/CCITT-FALSE (polinomio 0x1021, inicio 0xFFFF) de seq..temp.
+SINCRONIA = 0xA5
+_SINCRONIA = bytes([SINCRONIA])
+_TRAMA_BINARIA = struct.Struct('<BHBHhH')
+TAMANO_BINARIA = _TRAMA_BINARIA.size
+TEMP_INVALIDA = -32768
+
+# ============= SEPARADOR DE TRAMAS =============
+# Acumula en un único bytearray lo que se lee del puerto serial y corta las
+# líneas completas. La línea incompleta queda en el buffer para la siguiente
+# lectura, así que se pueden procesar muchas tramas por cada despertar.
+MAX_LINEA = 256
+
+
+class SeparadorTramas:
+    def __init__(self, max_linea=MAX_LINEA):
+        self.buffer = bytearray()
+        self.max_linea = max_linea
+        self.bytes_descartados = 0
+        self.errores_crc = 0
+        self.tramas_perdidas = 0
+        self.ultimo_seq = None
+
+    def alimentar(self, datos):
+        buffer = self.buffer
+        buffer += datos
+        tramas = []
+        inicio = 0
+        largo = len(buffer)
+        vista = memoryview(buffer)
+        
+        while inicio < largo:
+            # Trama binaria: longitud fija, validada por CRC
+            if buffer[inicio] == SINCRONIA:
+                if largo - inicio < TAMANO_BINARIA:
+                    break
+                fin = inicio + TAMANO_BINARIA
+                if crc_hqx(vista[inicio + 1:fin - 2], 0xFFFF) == buffer[fin - 2] | buffer[fin - 1] << 8:
+                    self._contar_secuencia(buffer[inicio + 1] | buffer[inicio + 2] << 8)
+                    tramas.append(bytes(vista[inicio:fin]))
+                    inicio = fin
+                else:
+                    # Falsa sincronía o trama corrupta: avanzar un byte y resincronizar
+                    self.errores_crc += 1
+                    inicio += 1
+                continue
+            
+            # Línea de texto (JSON o formato antiguo)
+            fin = buffer.find(b'\n', inicio)
+            sincronia = buffer.find(_SINCRONIA, inicio, fin if fin >= 0 else largo)
+            if sincronia >= 0:
+                # Bytes sueltos antes de una trama binaria
+                self.bytes_descartados += sincronia - inicio
+                inicio = sincronia
+                continue
+            if fin < 0:
+                break
+            final = fin
+            # Quitar el '\r' de println() del Arduino
+            if final > inicio and buffer[final - 1] == 13:
+                final -= 1
+            if final > inicio:
+                tramas.append(bytes(vista[inicio:final]))
+            inicio = fin + 1
+        
+        # Hay que soltar la vista antes de redimensionar el bytearray
+        vista.release()
+        if inicio:
+            del buffer[:inicio]
+        
+        # Ruido sin saltos de línea (baudios incorrectos, cable suelto): descartar
+        if len(buffer) > self.max_linea:
+            self.bytes_descartados += len(buffer)
+            buffer.clear()
+        
+        return tramas
+
+    def _contar_secuencia(self, seq):
+        if self.ultimo_seq is not None:
+            salto = (seq - self.ultimo_seq) & 0xFFFF
+            # Un salto hacia atrás (o enorme) es un reinicio del Arduino, no pérdidas
+            if 1 < salto < 0x8000:
+                self.tramas_perdidas += salto - 1
+        self.ultimo_seq = seq
+
+    def reiniciar(self):
+        self.buffer.clear()
+        self.ultimo_seq = None
+
+
+# ============= FORMATO ANTIGUO "IR:..,ULTRA:..,TEMP:..,BOMBA:.." =============
+# Una sola pasada: la expresión valida la trama y captura los cuatro campos
+_PATRON_LEGADO = re.compile(rb'IR:(\d+),ULTRA:(\d+\.?\d*),TEMP:(\d+\.?\d*),BOMBA:([01])')
+
+
+def parsear_legado(linea):
+    coincidencia = _PATRON_LEGADO.match(linea)
+    if coincidencia is None:
+        return None
+    ir, ultra, temp, bomba = coincidencia.groups()
+    return Trama(int(ir), float(ultra), float(temp), bomba == b'1')
+
+
+# ============= FORMATO JSON =============
+# {"IR":0,"ULTRA":12.3,"TEMP":24.5,"BOMBA":"ON"}: los cuatro campos son
+# obligatorios. TEMP admite null (sensor desconectado) y se muestra como "Error".
+if msgspec is not None:
+    class TramaJSON(msgspec.Struct):
+        IR: int
+        ULTRA: float
+        TEMP: Optional[float]
+        BOMBA: Literal["ON", "OFF"]
+
+    # Decodifica directo a la estructura, sin crear un dict por trama
+    _decodificador_json = msgspec.json.Decoder(TramaJSON)
+
+    def decodificar_json(linea):
+        try:
+            data = _decodificador_json.decode(linea)
+        except (msgspec.DecodeError, UnicodeDecodeError):
+            return None
+        return Trama(data.IR, data.ULTRA, data.TEMP, data.BOMBA == "ON")
+
+    BACKEND_JSON = "msgspec"
+else:
+    if orjson is not None:
+        _cargar_json = orjson.loads
+    else:
+        _decodificador_json = json.JSONDecoder()
+
+        # raw_decode() sobre str evita la detección de codificación de json.loads(bytes)
+        def _cargar_json(linea):
+            texto = linea.decode('utf-8')
+            data, fin = _decodificador_json.raw_decode(texto)
+            if fin != len(texto) and texto[fin:].strip():
+                raise ValueError("Datos extra tras el JSON")
+            return data
+
+    def decodificar_json(linea):
+        try:
+            data = _cargar_json(linea)
+            ir = data["IR"]
+            ultra = data["ULTRA"]
+            temp = data["TEMP"]
+            bomba = data["BOMBA"]
+        except (ValueError, KeyError, TypeError):
+            return None
+        
+        # Mismas reglas que TramaJSON (type() excluye True/False como números)
+        if type(ir) is not int:
+            return None
+        if type(ultra) is not float and type(ultra) is not int:
+            return None
+        if temp is not None and type(temp) is not float and type(temp) is not int:
+            return None
+        if bomba != "ON" and bomba != "OFF":
+            return None
+        return Trama(ir, float(ultra), None if temp is None else float(temp), bomba == "ON")
+
+    BACKEND_JSON = "orjson" if orjson is not None else "json"
+
+
+# ============= FORMATO BINARIO: CODIFICACIÓN / DECODIFICACIÓN =============
+def decodificar_binaria(trama):
+    _, seq, banderas, ultra_mm, temp_centesimas, _ = _TRAMA_BINARIA.unpack_from(trama)
+    temp = None if temp_centesimas == TEMP_INVALIDA else temp_centesimas / 100
+    return Trama(banderas & 1, ultra_mm / 10, temp, bool(banderas & 2), seq)
+
+
+def codificar_binaria(trama, seq):
+    banderas = (1 if trama.ir else 0) | (2 if trama.bomba else 0)
+    temp = TEMP_INVALIDA if trama.temp is None else round(trama.temp * 100)
+    cuerpo = _TRAMA_BINARIA.pack(SINCRONIA, seq & 0xFFFF, banderas, round(trama.ultra * 10), temp, 0)
+    crc = crc_hqx(cuerpo[1:-2], 0xFFFF)
+    return cuerpo[:-2] + crc.to_bytes(2, 'little')
+
+
+# ============= DETECCIÓN DEL TIPO DE TRAMA =============
+# Basta con mirar el primer byte: '{' es JSON, 'I' el formato antiguo y 0xA5
+# una trama binaria (el separador ya validó su CRC)
+def parsear_linea(linea):
+    if not linea:
+        return None
+    primero = linea[0]
+    if primero == 0x7B:  # '{'
+        return decodificar_json(linea)
+    if primero == SINCRONIA:
+        return decodificar_binaria(linea)
+    if primero == 0x49:  # 'I'
+        return parsear_legado(linea)
+    return None